@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import h5py
+import decoder
+import getData
+import sources
+import converter
+import pipeline
+import h5writer
+import calibration
+"""
+acquisition throughput benchmark, runs on the synthetic source so no card
+is needed:
+
+python benchmark.py [samples] [block]
+
+Every stage of the logger (read, decode, calibrate, buffer, write) is timed
+for the old per-sample path and the block path, then the whole pipeline is
+run for a few seconds. Numbers are samples per second, best of 3 runs.
+"""
+
+def best_rate(func, n, repeat=3):
+	"""samples/s of func() which processes n samples, best of repeat runs"""
+	best = None
+	for i in range(repeat):
+		t = time.time()
+		func()
+		dt = time.time()-t
+		best = dt if best is None else min(best, dt)
+	return n/max(best, 1e-9)
+
+def report(stage, path, rate):
+	print "{:<10}{:<28}{:>14.0f}{:>12.3f}".format(stage, path, rate, 1e6/rate)
+
+def run(samples=100000, block=1000):
+	blocks = samples//block
+	samples = blocks*block
+	single = getData.Eyeball(backend=sources.SyntheticBackend())
+	clocked = getData.Eyeball(backend=sources.SyntheticBackend(), rate=1e5, samples=block)
+	lines = clocked.readBlock().copy()
+	el_bcd, az_bin, revs = decoder.decode(lines)
+	els = converter.eloffset+converter.elgain*el_bcd
+	azs = np.mod(converter.azoffset+converter.azgain*az_bin, 360.)
+	ts = np.arange(block)*1e-5
+	few = max(samples//100, 1) #the per-sample paths are slow, time fewer
+
+	print "{:<10}{:<28}{:>14}{:>12}".format("stage", "path", "samples/s", "us/sample")
+	report("read", "single sample", best_rate(lambda: [single.getLines() for i in xrange(few)], few))
+	report("read", "block of {}".format(block), best_rate(lambda: [clocked.readBlock() for i in xrange(blocks)], samples))
+
+	def strings():
+		for i in xrange(few):
+			s = single.getData()
+			converter.bcd_to_int(s[0]), converter.bin_to_int(s[1]), converter.bin_to_int(s[2])
+	report("decode", "strings (incl. read)", best_rate(strings, few))
+	report("decode", "decoder.decode block", best_rate(lambda: [decoder.decode(lines) for i in xrange(blocks)], samples))
+
+	def per_sample_calibration():
+		for x, y in zip(el_bcd[:few], az_bin[:few]):
+			converter.eloffset+converter.elgain*x, np.mod(converter.azoffset+converter.azgain*y, 360.)
+	report("calibrate", "per sample", best_rate(per_sample_calibration, min(few, block)))
+	report("calibrate", "block formula", best_rate(lambda: [(converter.eloffset+converter.elgain*el_bcd,
+	       np.mod(converter.azoffset+converter.azgain*az_bin, 360.)) for i in xrange(blocks)], samples))
+	cal = calibration.Calibration(converter.azgain, converter.azoffset, converter.elgain, converter.eloffset)
+	report("calibrate", "lookup table", best_rate(lambda: [(cal.el(el_bcd), cal.az(az_bin)) for i in xrange(blocks)], samples))
+
+	def add():
+		Data = converter.datacollector()
+		for i in xrange(few//block+1):
+			for el, az, rev in zip(els, azs, revs):
+				Data.add(el, az, rev)
+	report("buffer", "datacollector.add", best_rate(add, (few//block+1)*block))
+	def extend():
+		Data = converter.datacollector()
+		for i in xrange(blocks):
+			Data.extend(els, azs, revs, ts)
+	report("buffer", "datacollector.extend", best_rate(extend, samples))
+
+	Data = converter.datacollector()
+	for i in xrange(blocks):
+		Data.extend(els, azs, revs, ts)
+	records = Data.getData()
+	tmp = tempfile.mkdtemp()
+	try:
+		def rewrite():
+			#what fileStruct does: the whole collection again every interval
+			for i in xrange(1, 11):
+				with h5py.File(os.path.join(tmp, "rewrite.h5"), 'w') as h5file:
+					h5file.create_dataset("data", data=records[:i*samples//10])
+		report("write", "rewrite file x10", best_rate(rewrite, samples))
+		def append():
+			writer = h5writer.RotatingWriter(root=tmp)
+			for i in xrange(10):
+				writer.write(records[i*samples//10:(i+1)*samples//10], now=0)
+			writer.close()
+		report("write", "RotatingWriter append x10", best_rate(append, samples))
+
+		logger = converter.EncoderLogger(1.0, h5writer.RotatingWriter(root=tmp))
+		pipe = pipeline.Pipeline(clocked, logger)
+		pipe.start()
+		time.sleep(5)
+		pipe.stop()
+		logger.close()
+		stats = pipe.stats()
+		report("pipeline", "synthetic, unpaced", stats["written"]/5.)
+		print "pipeline dropped {dropped} of {read} samples".format(**stats)
+	finally:
+		shutil.rmtree(tmp)
+
+if __name__=='__main__':
+	run(*map(int, sys.argv[1:3]))
@@ -0,0 +1,56 @@
+import numpy as np
+import decoder
+"""
+encoder code to degree conversion through lookup tables
+
+The elevation encoder only produces decoder.EL_CODES distinct values and the
+azimuth encoder 2**16, so every possible answer of
+
+el = eloffset+elgain*code
+az = np.mod(azoffset+azgain*code, 360.)
+
+is computed once and converting a block of codes is a single take().
+"""
+
+class Calibration(object):
+	"""holds the gains and offsets and the tables built from them. Setting
+	any of the four attributes rebuilds the affected table."""
+	def __init__(self, azgain, azoffset, elgain, eloffset):
+		self._azgain, self._azoffset = azgain, azoffset
+		self._elgain, self._eloffset = elgain, eloffset
+		self._build_az()
+		self._build_el()
+
+	def _build_az(self):
+		codes = np.arange(decoder.AZ_CODES)
+		self.az_table = np.mod(self._azoffset+self._azgain*codes, 360.)
+
+	def _build_el(self):
+		codes = np.arange(decoder.EL_CODES)
+		self.el_table = self._eloffset+self._elgain*codes
+
+	def _az_property(name):
+		def set(self, val):
+			setattr(self, name, val)
+			self._build_az()
+		return property(lambda self: getattr(self, name), set)
+
+	def _el_property(name):
+		def set(self, val):
+			setattr(self, name, val)
+			self._build_el()
+		return property(lambda self: getattr(self, name), set)
+
+	azgain = _az_property("_azgain")
+	azoffset = _az_property("_azoffset")
+	elgain = _el_property("_elgain")
+	eloffset = _el_property("_eloffset")
+	del _az_property, _el_property
+
+	def az(self, codes):
+		"""degrees for an int or array of raw azimuth codes"""
+		return self.az_table.take(codes)
+
+	def el(self, codes):
+		"""degrees for an int or array of decoded BCD elevation codes"""
+		return self.el_table.take(codes)
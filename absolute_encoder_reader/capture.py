@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import numpy as np
+import decoder
+import getData
+import timing
+"""
+raw capture: the fastest way to log, nothing is decoded while acquiring
+
+python capture.py out.raw [rate] [samples per read]
+
+Raw port bytes from Eyeball go straight into a np.memmap that grows as
+needed. The file is a HEADER record followed by count rows of lines bytes.
+Next to it, out.raw.times holds one (last sample index, monotonic time)
+pair per read so sample times can be rebuilt. decode_capture.py turns a
+capture into the usual HH-MM.h5 files.
+"""
+
+MAGIC = "COFERAW1"
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("lines", "<u4"),
+                   ("count", "<u8"), ("rate", "<f8"), ("utc_anchor", "<f8"),
+                   ("monotonic_anchor", "<f8"), ("reserved", "<u1", 16)])
+TIMES = np.dtype([("index", "<i8"), ("t", "<f8")])
+
+class RawCapture(object):
+	"""appends (N, lines) uint8 blocks to path. The memmap starts at
+	capacity rows and doubles when full; close() trims the file to what was
+	written. rate is the sample clock rate, 0 for software timed reads."""
+	def __init__(self, path, lines=decoder.LINES, rate=None, capacity=2**20):
+		self.path = path
+		self.lines = lines
+		self.count = 0
+		self.capacity = capacity
+		self.header = np.zeros(1, dtype=HEADER)
+		self.header["magic"] = MAGIC
+		self.header["version"] = 1
+		self.header["lines"] = lines
+		self.header["rate"] = rate or 0
+		self.header["utc_anchor"] = time.time()
+		self.header["monotonic_anchor"] = timing.monotonic()
+		with open(path, 'wb') as f:
+			self.header.tofile(f)
+		self.times = open(path+".times", 'wb')
+		self._map()
+
+	def _map(self):
+		#(re)maps the data part of the file at the current capacity
+		with open(self.path, 'r+b') as f:
+			f.truncate(HEADER.itemsize+self.capacity*self.lines)
+		self.data = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=HEADER.itemsize,
+		                      shape=(self.capacity, self.lines))
+
+	def append(self, block, t):
+		"""stores a block of samples whose read returned at monotonic time t"""
+		n = len(block)
+		if self.count+n > self.capacity:
+			self.data.flush()
+			del self.data
+			while self.count+n > self.capacity:
+				self.capacity *= 2
+			self._map()
+		self.data[self.count:self.count+n] = block
+		self.count += n
+		np.array([(self.count-1, t)], dtype=TIMES).tofile(self.times)
+
+	def flush(self):
+		"""writes the data and the sample count in the header to disk"""
+		self.data.flush()
+		self.times.flush()
+		self.header["count"] = self.count
+		with open(self.path, 'r+b') as f:
+			self.header.tofile(f)
+
+	def close(self):
+		self.flush()
+		del self.data
+		self.times.close()
+		with open(self.path, 'r+b') as f:
+			f.truncate(HEADER.itemsize+self.count*self.lines)
+
+def open_capture(path):
+	"""returns (header, data, times) of a capture, data is a read only
+	(count, lines) memmap. A capture that was not closed cleanly has the
+	count of its last flush in the header, the times file tells how far it
+	really got."""
+	header = np.fromfile(path, dtype=HEADER, count=1)[0]
+	if header["magic"] != MAGIC:
+		raise ValueError("{} is not a raw capture".format(path))
+	times = np.fromfile(path+".times", dtype=TIMES) if os.path.exists(path+".times") else np.zeros(0, TIMES)
+	count = int(header["count"])
+	if len(times):
+		count = max(count, int(times["index"][-1])+1)
+	size = (os.path.getsize(path)-HEADER.itemsize)//int(header["lines"])
+	count = min(count, size)
+	if count == 0: #np.memmap refuses empty maps
+		return header, np.zeros((0, int(header["lines"])), dtype=np.uint8), times
+	data = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.itemsize,
+	                 shape=(count, int(header["lines"])))
+	return header, data, times
+
+if __name__=='__main__':
+	path = sys.argv[1]
+	rate = float(sys.argv[2]) if len(sys.argv)>2 else None
+	samples = int(sys.argv[3]) if len(sys.argv)>3 else max(1, int((rate or 0)/10))
+	eye = getData.Eyeball(rate=rate, samples=samples)
+	capture = RawCapture(path, rate=rate)
+	time_a = time.time()
+	try:
+		while True:
+			block = eye.readBlock()
+			capture.append(block, timing.monotonic())
+			if time.time()-time_a >= 1:
+				capture.flush()
+				time_a = time.time()
+	except KeyboardInterrupt:
+		pass
+	eye.close()
+	capture.close()
+	print "captured {} samples".format(capture.count)
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import datetime as dt
+import multiprocessing
+import numpy as np
+import h5py
+import converter
+"""
+merges a night of per-minute files into one daily file
+
+python compact.py MM-DD-YYYY [output.h5] [processes]
+
+The HH-MM.h5 files of the date directory are read and cleaned by a process
+pool, in order, and appended to one chunked, gzip compressed "data"
+dataset (converter.DTYPE). Zero rows left over by the old fileStruct are
+dropped. The "index" dataset records where every minute file landed in
+"data", its time anchors and the number of samples whose time or counter
+went backwards.
+
+Every minute file has its own monotonic clock, so t is put on unix time
+while merging (the file attribute "time" is "utc"). Files without
+timestamps or anchors have their rows spread evenly over their minute,
+marked by "spread" in the index.
+"""
+
+INDEX = np.dtype([("file", "S8"), ("offset", np.int64), ("count", np.int64),
+                  ("zero_rows", np.int64), ("t_backsteps", np.int64),
+                  ("rev_backsteps", np.int64), ("utc_anchor", np.float64),
+                  ("monotonic_anchor", np.float64), ("spread", np.bool_)])
+REV_MODULUS = 2**24
+
+def backsteps(values, modulus=None):
+	"""number of places where values decrease. With a modulus a wrap around
+	(a drop of more than half the modulus) counts as going forward."""
+	steps = np.diff(values)
+	if modulus is not None:
+		steps = (steps+modulus//2) % modulus - modulus//2
+	return int(np.count_nonzero(steps < 0))
+
+def minute_start(path):
+	"""unix time of the local minute a MM-DD-YYYY/HH-MM.h5 path is named after"""
+	day = os.path.basename(os.path.dirname(os.path.abspath(path)))
+	t = dt.datetime.strptime(day+" "+os.path.basename(path)[:-len(".h5")], "%m-%d-%Y %H-%M")
+	return time.mktime(t.timetuple())
+
+def load(path):
+	"""worker: returns (name, records, zero rows, (utc, monotonic) anchor,
+	spread) for one minute file, t in unix time"""
+	with h5py.File(path, 'r') as h5file:
+		raw = h5file["data"][...]
+		anchor = (float(h5file.attrs["utc_anchor"]), float(h5file.attrs["monotonic_anchor"])) \
+		         if "utc_anchor" in h5file.attrs else (np.nan, np.nan)
+	records = np.zeros(len(raw), dtype=converter.DTYPE)
+	records["t"] = np.nan
+	for name in raw.dtype.names:
+		if name in records.dtype.names:
+			records[name] = raw[name]
+	zero = np.ones(len(raw), dtype=bool)
+	for name in raw.dtype.names:
+		zero &= raw[name] == 0
+	records = records[~zero]
+	spread = "t" not in raw.dtype.names or np.isnan(anchor[0])
+	if spread:
+		records["t"] = minute_start(path)+60.*np.arange(len(records))/max(len(records), 1)
+	else:
+		records["t"] += anchor[0]-anchor[1]
+	return os.path.basename(path)[:-len(".h5")], records, int(zero.sum()), anchor, spread
+
+def compact(date_dir, out_path=None, processes=None):
+	"""writes the daily file and returns its index"""
+	out_path = out_path or date_dir.rstrip("/\\")+".h5"
+	names = sorted(f for f in os.listdir(date_dir) if f.endswith(".h5"))
+	paths = [os.path.join(date_dir, f) for f in names]
+	pool = multiprocessing.Pool(processes)
+	index = np.zeros(len(paths), dtype=INDEX)
+	with h5py.File(out_path, 'w') as h5file:
+		data = h5file.create_dataset("data", shape=(0,), maxshape=(None,), dtype=converter.DTYPE,
+		                             chunks=(2**16,), compression="gzip", shuffle=True)
+		last = None #last record of the previous file, to check across files
+		for i, (name, records, zero_rows, anchor, spread) in enumerate(pool.imap(load, paths)):
+			offset = data.shape[0]
+			data.resize((offset+len(records),))
+			data[offset:] = records
+			checked = records if last is None else np.concatenate([last, records])
+			t = checked["t"][~np.isnan(checked["t"])]
+			index[i] = (name, offset, len(records), zero_rows, backsteps(t),
+			            backsteps(checked["rev"], REV_MODULUS), anchor[0], anchor[1], spread)
+			if len(records):
+				last = records[-1:]
+		pool.close()
+		pool.join()
+		h5file.create_dataset("index", data=index)
+		h5file.attrs["source"] = date_dir
+		h5file.attrs["time"] = "utc"
+	return index
+
+if __name__=='__main__':
+	date_dir = sys.argv[1]
+	out_path = sys.argv[2] if len(sys.argv)>2 else None
+	processes = int(sys.argv[3]) if len(sys.argv)>3 else None
+	index = compact(date_dir, out_path, processes)
+	print "{} files, {} samples, {} zero rows dropped".format(len(index), index["count"].sum(), index["zero_rows"].sum())
+	for row in index[(index["t_backsteps"]>0) | (index["rev_backsteps"]>0)]:
+		print "{}: time went back {} times, counter {} times".format(row["file"], row["t_backsteps"], row["rev_backsteps"])
@@ -3,6 +3,11 @@ import datetime as dt
 import numpy as np
 import h5py
 import getData
+import decoder
+import pipeline
+import h5writer
+import timing
+import calibration
 import time
 import sys
 
@@ -46,23 +51,89 @@ def fileStruct(n_array, data):
 	
 	
 
+#t is the monotonic time of the sample, see timing.py
+DTYPE = [("el", np.float), ("az", np.float), ("rev", np.int), ("t", np.float64)]
+
 class datacollector(object):
-	def __init__(self):
+	"""collects samples in a preallocated structured array. When it fills
+	up the capacity doubles, so a run of n adds costs O(n) copying in total
+	instead of the O(n**2) of growing by a fixed amount."""
+	def __init__(self, capacity=2**16):
 		self.index = 0
-		self.free_space = 0
-		self.data = np.zeros(self.free_space, dtype=[("el", np.float), ("az", np.float), ("rev", np.int)])
+		self.free_space = capacity #allocated rows
+		self.data = np.zeros(self.free_space, dtype=DTYPE)
 	def resetIndex(self):
 		self.index=0
-	def add(self,az,el,rev):
-		if self.index>=self.free_space:
-				self.data.resize(self.index+1000, 1)
-				self.free_space = self.free_space+1000
-		self.data[self.index] = ((az,el,rev))
+	def reserve(self, n):
+		"""makes room for n more samples"""
+		needed = self.index+n
+		if needed > self.free_space:
+			while self.free_space < needed:
+				self.free_space = max(2*self.free_space, 1)
+			grown = np.zeros(self.free_space, dtype=DTYPE)
+			grown[:self.index] = self.data[:self.index]
+			self.data = grown
+	def add(self,el,az,rev,t=0.):
+		self.reserve(1)
+		self.data[self.index] = ((el,az,rev,t))
 		
 		self.index =self.index+ 1
+	def extend(self, el, az, rev, t):
+		"""adds a block of samples given as equal length arrays"""
+		n = len(el)
+		self.reserve(n)
+		rows = self.data[self.index:self.index+n]
+		rows["el"] = el
+		rows["az"] = az
+		rows["rev"] = rev
+		rows["t"] = t
+		self.index = self.index+n
 		
 	def getData(self):
-		return self.data
+		"""returns a view of the samples collected since the last
+		resetIndex. It is overwritten by later adds, copy it to keep it."""
+		return self.data[:self.index]
+
+class EncoderLogger(object):
+	"""pipeline handler: decodes and calibrates batches of raw samples into
+	a datacollector and appends it to the current file every interval
+	seconds. pointing is an optional model with apply(az, el) returning the
+	corrected (az, el) arrays, like telescope_control's PointingModel"""
+	def __init__(self, interval, writer=None, pointing=None):
+		self.interval = interval
+		self.writer = h5writer.RotatingWriter() if writer is None else writer
+		self.Data = datacollector()
+		self.calibration = calibration.Calibration(azgain, azoffset, elgain, eloffset)
+		self.pointing = pointing
+		self.time_a = time.time()
+
+	def __call__(self, block, times):
+		el_bcd, az_bin, revs = decoder.decode(block)
+		
+		els=self.calibration.el(el_bcd)
+		azs=self.calibration.az(az_bin)
+		if self.pointing is not None:
+			azs, els = self.pointing.apply(azs, els)
+			azs = np.mod(azs, 360.) #the correction can cross 0/360
+		self.Data.extend(els, azs, revs, times)
+		el, az, rev = els[-1], azs[-1], revs[-1]
+		#print Data.getData()
+		time_b = time.time()
+		delta = time_b-self.time_a
+		if (delta>=2):
+			print rev,az,el
+		if(delta>=self.interval): 
+			self.write()
+			self.time_a=time.time();
+
+	def write(self):
+		self.writer.write(self.Data.getData())
+		self.Data.resetIndex()
+
+	def close(self):
+		"""writes whatever is left and closes the file"""
+		self.write()
+		self.writer.close()
 	
 	
 if __name__=='__main__':
@@ -75,41 +146,39 @@ if __name__=='__main__':
 	fileStruct(data)
 	'''
 	if len(sys.argv)==1: #this is the defualt no argument write time
-		sys.argv.append(60)
+		sys.argv.append(1) #appending is cheap, files still rotate every minute
+	#optional second argument: hardware sample clock rate in Hz
+	rate = float(sys.argv[2]) if len(sys.argv)>2 else None
+	#optional third argument: a telescope_control config.txt whose fitted
+	#pointing model corrects az/el before they are written
+	pointing = None
+	if len(sys.argv)>3:
+		sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "telescope_control"))
+		import config
+		import pointing as pointing_model
+		pointing = pointing_model.PointingModel.from_config(config.Config(sys.argv[3]))
+		print pointing
 	#data = np.zeros(1000, dtype=[("first", np.int), ("second", np.int)])
-	eye = getData.Eyeball()
-	Data = datacollector()
-
-	#fileStruct(Data.getData())
+	eye = getData.Eyeball(rate=rate, samples=max(1, int((rate or 0)/10))) #~10 reads a second when clocked
 
-	time_a = time.time()
-	while True:
-		#timer loop
-		all = eye.getData()
-		
-		all = (bcd_to_int(all[0]), bin_to_int(all[1]), bin_to_int(all[2]))
-		
-		el=eloffset+elgain*all[0]
-		az=np.mod(azoffset + azgain*all[1],360.)
-		rev=all[2]
-		Data.add(el,az,rev)
-		#print Data.getData()
-		time_b = time.time()
-		delta = time_b-time_a
-		if (delta>=2):
-			print rev,az,el
-		if(delta>=int(sys.argv[1])): 
-			fileStruct(Data.getData(), Data)
-			time_a=time.time();
-			print "file written"
-			
-	print "data collected at" + str(1.0/delta) +"HZ"
-		
-		
-	
-		
-		#print delta
-		
-		#time.sleep(.03-delta)
-		
-		
\ No newline at end of file
+	#reads happen in their own thread so writing a file leaves no gap
+	loop_stats = timing.LoopStats()
+	#loop statistics and the utc anchor for t are saved as file attributes
+	logger = EncoderLogger(float(sys.argv[1]), h5writer.RotatingWriter(attrs=loop_stats.snapshot), pointing)
+	pipe = pipeline.Pipeline(eye, logger, loop_stats=loop_stats)
+	pipe.start()
+	time_start = time.time()
+	try:
+		while pipe.alive():
+			time.sleep(10)
+			print "{rate:.1f} HZ, longest stall {max_stall:.4f} s, dropped {dropped}".format(**pipe.stats())
+	except KeyboardInterrupt:
+		pass
+	pipe.stop()
+	eye.close()
+	logger.close()
+	if pipe.error is not None:
+		print "pipeline stopped:", pipe.error
+	stats = pipe.stats()
+	print "data collected at " + str(stats["read"]/(time.time()-time_start)) +" HZ"
+	print "dropped {dropped} of {read} samples".format(**stats)
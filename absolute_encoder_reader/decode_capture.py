@@ -0,0 +1,59 @@
+import sys
+import numpy as np
+import decoder
+import capture
+import converter
+import calibration
+import h5writer
+"""
+offline decoding of raw captures made with capture.py
+
+python decode_capture.py capture.raw [output directory] [chunk rows]
+
+The capture is decoded chunk by chunk, so memory use does not depend on its
+length, into the same MM-DD-YYYY/HH-MM.h5 files (el, az, rev, t records)
+converter.py writes while logging.
+"""
+
+def sample_times(header, times, start, stop):
+	"""monotonic times of samples start..stop-1, interpolated between the
+	read stamps. The first read is spread back by the sample period if the
+	capture was clocked."""
+	index, t = times["index"].astype(np.float64), times["t"]
+	if len(index) == 0:
+		return np.zeros(stop-start)
+	if header["rate"] > 0:
+		index = np.concatenate([[0.], index])
+		t = np.concatenate([[t[0]-index[1]/header["rate"]], t])
+	return np.interp(np.arange(start, stop), index, t)
+
+def decode_capture(path, root=".", chunk=2**20, period=60, compression=None):
+	"""writes the decoded capture to root, returns the number of samples"""
+	header, data, times = capture.open_capture(path)
+	cal = calibration.Calibration(converter.azgain, converter.azoffset, converter.elgain, converter.eloffset)
+	anchor = {"utc_anchor":header["utc_anchor"], "monotonic_anchor":header["monotonic_anchor"],
+	          "rate":header["rate"], "source":path}
+	writer = h5writer.RotatingWriter(root, period=period, compression=compression,
+	                                 flush_seconds=None, attrs=lambda: anchor)
+	Data = converter.datacollector(chunk)
+	for start in xrange(0, len(data), chunk):
+		stop = min(start+chunk, len(data))
+		el_bcd, az_bin, revs = decoder.decode(data[start:stop])
+		t = sample_times(header, times, start, stop)
+		Data.resetIndex()
+		Data.extend(cal.el(el_bcd), cal.az(az_bin), revs, t)
+		records = Data.getData()
+		#split the chunk where the wall clock minute (file) changes
+		utc = header["utc_anchor"]+(t-header["monotonic_anchor"])
+		slots = (utc//period).astype(np.int64)
+		edges = np.flatnonzero(np.diff(slots))+1
+		for a, b in zip(np.concatenate([[0], edges]), np.concatenate([edges, [len(records)]])):
+			writer.write(records[a:b], now=utc[a])
+	writer.close()
+	return len(data)
+
+if __name__=='__main__':
+	path = sys.argv[1]
+	root = sys.argv[2] if len(sys.argv)>2 else "."
+	chunk = int(sys.argv[3]) if len(sys.argv)>3 else 2**20
+	print "decoded {} samples".format(decode_capture(path, root, chunk))
@@ -0,0 +1,76 @@
+import numpy as np
+"""
+vectorized decoding of the DIO line bytes read by getData.Eyeball
+
+DAQmxReadDigitalLines gives one uint8 per line (0 or 1). The eight ports are
+read in the order 10, 7, 4, 2, 5, 0, 3, 9 so line k of the sample is bit
+(k%8) of the (k/8)th port in that list. The bit layouts below are the same
+ones Eyeball.getData builds its strings from, most significant bit first:
+
+el  (18 bits BCD) = P10.7-P10.2, P7.7-P7.2, P4.7-P4.2
+az  (16 bits)     = P2.7-P2.0, P5.7-P5.0
+rev (24 bits)     = P0.7-P0.0, P3.7-P3.0, P9.7-P9.0
+
+Rather than building and parsing strings the bits are multiplied with a
+(LINES, 3) weight matrix, so a single sample or a whole (N, LINES) block is
+decoded with one dot product.
+"""
+
+LINES = 64 #8 ports of 8 lines each
+
+def _port_bits(port, hi, lo):
+	#line indices of port bits hi..lo, msb first
+	return [8*port+b for b in range(hi, lo-1, -1)]
+
+EL_LINES = _port_bits(0, 7, 2)+_port_bits(1, 7, 2)+_port_bits(2, 7, 2)
+AZ_LINES = _port_bits(3, 7, 0)+_port_bits(4, 7, 0)
+REV_LINES = _port_bits(5, 7, 0)+_port_bits(6, 7, 0)+_port_bits(7, 7, 0)
+
+#the elevation word is one 2 bit digit followed by four 4 bit BCD digits
+EL_BIT_WEIGHTS = [2*10000, 10000]
+for _digit in (1000, 100, 10, 1):
+	EL_BIT_WEIGHTS += [8*_digit, 4*_digit, 2*_digit, _digit]
+
+WEIGHTS = np.zeros((LINES, 3), dtype=np.int64)
+WEIGHTS[EL_LINES, 0] = EL_BIT_WEIGHTS
+WEIGHTS[AZ_LINES, 1] = [2**b for b in range(15, -1, -1)]
+WEIGHTS[REV_LINES, 2] = [2**b for b in range(23, -1, -1)]
+
+#number of distinct values each word can decode to. The elevation range
+#includes invalid BCD digits (10-15) so lookup tables indexed by el never
+#overflow on a glitched read.
+EL_CODES = int(sum(EL_BIT_WEIGHTS))+1
+AZ_CODES = 2**16
+REV_CODES = 2**24
+
+def decode_words(lines):
+	"""returns an (..., 3) int64 array of (el, az, rev) for a single sample
+	of shape (LINES,) or a block of shape (N, LINES). Extra trailing lines
+	(Eyeball's read buffer is 97 wide) are ignored."""
+	lines = np.asarray(lines)
+	return np.dot(lines[..., :LINES], WEIGHTS)
+
+def decode(lines):
+	"""returns (el, az, rev). These are ints for a single sample and int64
+	arrays of length N for an (N, LINES) block. el is the decimal value of
+	the BCD word, i.e. the same number converter.bcd_to_int gives."""
+	return tuple(decode_words(lines).T)
+
+def _bits(words, n):
+	#(N, n) array of the n low bits of words, msb first
+	shifts = np.arange(n-1, -1, -1)
+	return (words[:, None] >> shifts) & 1
+
+def encode(el, az, rev):
+	"""inverse of decode: returns the (N, LINES) uint8 line array that reads
+	as the given el (decimal, < 40000), az and rev values"""
+	el = np.atleast_1d(np.asarray(el, dtype=np.int64))
+	az = np.atleast_1d(np.asarray(az, dtype=np.int64))
+	rev = np.atleast_1d(np.asarray(rev, dtype=np.int64))
+	digits = [el//10000]+[el//place % 10 for place in (1000, 100, 10, 1)]
+	el_bits = np.hstack([_bits(digits[0], 2)]+[_bits(d, 4) for d in digits[1:]])
+	lines = np.zeros((len(el), LINES), dtype=np.uint8)
+	lines[:, EL_LINES] = el_bits
+	lines[:, AZ_LINES] = _bits(az, 16)
+	lines[:, REV_LINES] = _bits(rev, 24)
+	return lines
@@ -1,6 +1,11 @@
-from PyDAQmx import *
-from PyDAQmx.DAQmxCallBack import *
-from numpy import zeros
+try:
+	from PyDAQmx import *
+	from PyDAQmx.DAQmxCallBack import *
+except ImportError: #no NI driver installed, only FakeBackend is usable
+	pass
+import numpy
+import time
+import decoder
 """ 
 functions to get DIO data and parse in to Az encoder, El encoder and 24 bit counter numbers
 Mappings to DIO board  P
@@ -17,44 +22,114 @@ P0.7  -  P0.0 = J5.23 - J5.16   (MSB=J4.1, LSB=J4.18)
 P3.7  -  P3.0 = J5.15 - J5.8
 P9.7  -  P9.0 = J5.7  - J5.0
 """
-class Eyeball(object):
-	def __init__(self):
-		self.data = numpy.zeros((97,), dtype=numpy.uint8)
-		self.i = 0
-		self.err=""
+PORTS = ["port10", "port7", "port4", "port2", "port5", "port0", "port3", "port9"]
+
+class DAQmxBackend(object):
+	"""reads the encoder ports of the NI card through PyDAQmx"""
+	def __init__(self, device="Dev1", clock_source=""):
 		self.read, self.bytesPerSamp=int32(), int32()
-		DAQmxResetDevice('dev1')
+		self.clock_source = clock_source
+		DAQmxResetDevice(device)
 		self.taskHandle=TaskHandle()
 		
 		DAQmxCreateTask("",byref(self.taskHandle))
-		
+		for port in PORTS:
+			DAQmxCreateDIChan(self.taskHandle,device+"/"+port,"",DAQmx_Val_ChanForAllLines)
 
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port10","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port7","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port4","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port2","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port5","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port0","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port3","",DAQmx_Val_ChanForAllLines)
-		DAQmxCreateDIChan(self.taskHandle,"Dev1/port9","",DAQmx_Val_ChanForAllLines)
-		
+	def start(self, rate=None, buffer_size=None):
+		"""with rate=None every read is a software timed single sample.
+		Otherwise the card samples on its clock at rate Hz into an onboard
+		buffer of buffer_size samples which read() then drains."""
+		if rate is not None:
+			DAQmxCfgSampClkTiming(self.taskHandle,self.clock_source,float(rate),DAQmx_Val_Rising,DAQmx_Val_ContSamps,buffer_size)
 		DAQmxStartTask(self.taskHandle)
 
+	def read(self, out, timeout=10.0):
+		"""fills out, an (N, decoder.LINES) uint8 array, with N samples and
+		returns the number of samples read"""
+		DAQmxReadDigitalLines(self.taskHandle,out.shape[0],timeout,DAQmx_Val_GroupByScanNumber,out,out.size,byref(self.read),byref(self.bytesPerSamp),None)
+		if self.bytesPerSamp.value != out.shape[1]:
+			raise ValueError("card returned {} lines per sample, expected {}".format(self.bytesPerSamp.value, out.shape[1]))
+		return self.read.value
+
+	def stop(self):
+		DAQmxStopTask(self.taskHandle)
+		DAQmxClearTask(self.taskHandle)
+
+class FakeBackend(object):
+	"""in-memory stand in for DAQmxBackend. samples is an (M, decoder.LINES)
+	array of line bytes that read() plays back in a loop. If paced is True
+	reads block like the card would, at the rate given to start()."""
+	def __init__(self, samples, paced=False):
+		self.samples = numpy.asarray(samples, dtype=numpy.uint8).reshape(-1, decoder.LINES)
+		self.paced = paced
+		self.pos = 0
+		self.rate = None
+		self.t_next = None
+
+	def start(self, rate=None, buffer_size=None):
+		self.rate = rate
+		self.t_next = time.time()
+
+	def wait(self, n):
+		#sleeps until n more samples would have been clocked in
+		if self.paced and self.rate is not None:
+			self.t_next += n/float(self.rate)
+			delay = self.t_next-time.time()
+			if delay > 0:
+				time.sleep(delay)
+
+	def read(self, out, timeout=10.0):
+		n = out.shape[0]
+		self.wait(n)
+		index = numpy.arange(self.pos, self.pos+n) % len(self.samples)
+		self.samples.take(index, axis=0, out=out)
+		self.pos = (self.pos+n) % len(self.samples)
+		return n
+
+	def stop(self):
+		pass
+
+class Eyeball(object):
+	def __init__(self, backend=None, rate=None, samples=1, buffer_size=None):
+		"""backend defaults to the NI card. If rate (Hz) is given the card is
+		hardware timed and readBlock returns samples samples per call,
+		otherwise reads are single software timed samples."""
+		self.backend = DAQmxBackend() if backend is None else backend
+		self.rate = rate
+		self.samples = samples if rate is not None else 1
+		if buffer_size is None: #default to a second worth of card buffer
+			buffer_size = max(10*self.samples, int(rate or 0))
+		self.block = numpy.zeros((self.samples, decoder.LINES), dtype=numpy.uint8)
+		self.data = self.block[0]
+		self.backend.start(rate, buffer_size)
+
 	def close(self):
 		print "bye"
 		
-		DAQmxStopTask(self.taskHandle)
-		DAQmxClearTask(self.taskHandle)
+		self.backend.stop()
 
 	def __del__(self):
 		#self.close()
 		pass
 
+	def readBlock(self):
+		"""returns an (N, decoder.LINES) array of samples. The array is reused
+		by the next read so decode or copy it first."""
+		n = self.backend.read(self.block)
+		return self.block[:n]
+
+	def getLines(self):
+		"""reads one sample and returns the raw line bytes, see decoder.py.
+		Only meant for the software timed mode."""
+		self.readBlock()
+		return self.data
+
 	def getData(self):
 		
-		DAQmxReadDigitalLines(self.taskHandle,1,10.0,DAQmx_Val_GroupByChannel,self.data,100,byref(self.read),byref(self.bytesPerSamp),None)
+		self.getLines()
 		index=0
-		all = [self.data[d] for d in range(0,95)]
+		all = [self.data[d] for d in range(0,decoder.LINES)]
 		all = map(str, all) 
 
 		return  [''.join((all[2:8])[::-1])+''.join((all[10:16])[::-1])+''.join((all[18:24])[::-1]), ''.join((all[24:32])[::-1])+"".join((all[32:40])[::-1]), ''.join((all[40:48])[::-1])+''.join((all[48:56])[::-1])+''.join((all[56:64])[::-1])]
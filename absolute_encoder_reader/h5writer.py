@@ -0,0 +1,112 @@
+import os
+import time
+import datetime as dt
+import h5py
+"""
+append-only HDF5 output in the MM-DD-YYYY/HH-MM.h5 layout of fileStruct
+
+Instead of rewriting the whole file every interval, one file stays open per
+rotation period and records are appended to a resizable, chunked "data"
+dataset.
+"""
+
+def file_path(t, root="."):
+	"""path of the file holding samples taken at local time t (a datetime)"""
+	return os.path.join(root, t.strftime("%m-%d-%Y"), t.strftime("%H-%M")+".h5")
+
+class RotatingWriter(object):
+	"""appends structured arrays to root/MM-DD-YYYY/HH-MM.h5. A new file is
+	started every period seconds (60 gives the per-minute files fileStruct
+	makes), named after the start of the period.
+
+	chunk is the dataset chunk length in rows and compression is passed to
+	h5py ("gzip", "lzf" or None). The file is flushed after flush_rows rows
+	or flush_seconds seconds, whichever comes first; None disables either.
+	attrs is an optional function returning a dict of file attributes, they
+	are refreshed on every flush and when the file is closed."""
+	def __init__(self, root=".", period=60, chunk=2**14, compression=None,
+	             flush_rows=None, flush_seconds=1.0, attrs=None):
+		self.root = root
+		self.period = period
+		self.chunk = chunk
+		self.compression = compression
+		self.flush_rows = flush_rows
+		self.flush_seconds = flush_seconds
+		self.attrs = attrs
+		self.h5file = None
+		self.dataset = None
+		self.slot = None
+		self.path = None
+		self.unflushed = 0
+		self.last_flush = time.time()
+
+	def _open(self, slot, dtype):
+		self.close()
+		self.slot = slot
+		self.path = file_path(dt.datetime.fromtimestamp(slot*self.period), self.root)
+		directory = os.path.dirname(self.path)
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		self.h5file = h5py.File(self.path, 'a') #a restart in the same period appends
+		if "data" in self.h5file:
+			self.dataset = self.h5file["data"]
+			self._rebase()
+		else:
+			self.dataset = self.h5file.create_dataset("data", shape=(0,), maxshape=(None,),
+			                                          dtype=dtype, chunks=(self.chunk,),
+			                                          compression=self.compression)
+		self._write_attrs()
+
+	def _rebase(self):
+		"""a restart appends under a new (utc_anchor, monotonic_anchor) pair,
+		and on windows the monotonic clock restarts with the process. the t of
+		the rows already in the file is moved onto the new pair before it
+		replaces the old one, so one pair keeps covering every row"""
+		if self.attrs is None or "t" not in (self.dataset.dtype.names or ()):
+			return
+		old, new = self.h5file.attrs, self.attrs()
+		if "utc_anchor" not in old or "utc_anchor" not in new:
+			return
+		shift = ((old["utc_anchor"]-old["monotonic_anchor"])-
+		         (new["utc_anchor"]-new["monotonic_anchor"]))
+		if shift == 0:
+			return
+		for i in range(0, self.dataset.shape[0], self.chunk):
+			rows = self.dataset[i:i+self.chunk]
+			rows["t"] += shift
+			self.dataset[i:i+len(rows)] = rows
+
+	def _write_attrs(self):
+		if self.attrs is not None:
+			for key, val in self.attrs().items():
+				self.h5file.attrs[key] = val
+
+	def write(self, records, now=None):
+		"""appends records, rotating to a new file first if the period has
+		changed"""
+		now = time.time() if now is None else now
+		slot = int(now//self.period)
+		if slot != self.slot:
+			self._open(slot, records.dtype)
+		n = self.dataset.shape[0]
+		self.dataset.resize((n+len(records),))
+		self.dataset[n:] = records
+		self.unflushed += len(records)
+		if ((self.flush_rows is not None and self.unflushed >= self.flush_rows) or
+		    (self.flush_seconds is not None and now-self.last_flush >= self.flush_seconds)):
+			self.flush(now)
+
+	def flush(self, now=None):
+		if self.h5file is not None:
+			self._write_attrs()
+			self.h5file.flush()
+		self.unflushed = 0
+		self.last_flush = time.time() if now is None else now
+
+	def close(self):
+		if self.h5file is not None:
+			self._write_attrs()
+			self.h5file.close()
+		self.h5file = None
+		self.dataset = None
+		self.slot = None
@@ -0,0 +1,178 @@
+import threading
+import time
+import numpy as np
+import decoder
+import timing
+"""
+producer/consumer pipeline between Eyeball and the file writer
+
+The acquisition thread does nothing but read blocks from the card and copy
+them into a bounded RingBuffer. The writer thread drains the buffer and hands
+each batch of raw samples to a handler (decode, calibrate, write) so slow
+h5py calls no longer stall the reads.
+"""
+
+class RingBuffer(object):
+	"""bounded FIFO of fixed width sample rows and their timestamps, backed
+	by preallocated arrays. put() waits up to timeout seconds for space
+	(back-pressure on the producer) and drops whatever still does not fit,
+	counting it in self.dropped. timeout=None waits forever and never
+	drops."""
+	def __init__(self, capacity, width=decoder.LINES, dtype=np.uint8):
+		self.buf = np.zeros((capacity, width), dtype=dtype)
+		self.times = np.zeros(capacity, dtype=np.float64)
+		self.capacity = capacity
+		self.head = 0 #index of the oldest row
+		self.count = 0 #rows currently held
+		self.dropped = 0
+		self.closed = False
+		self.lock = threading.Lock()
+		self.not_empty = threading.Condition(self.lock)
+		self.not_full = threading.Condition(self.lock)
+
+	def __len__(self):
+		return self.count
+
+	def _wait(self, cond, deadline):
+		#waits on cond, returns False once the deadline has passed
+		if deadline is None:
+			cond.wait()
+			return True
+		remaining = deadline-time.time()
+		if remaining <= 0:
+			return False
+		cond.wait(remaining)
+		return True
+
+	def put(self, rows, times, timeout=None):
+		"""copies rows, an (N, width) array, and their N times into the
+		buffer. Returns the number of rows stored, the rest were dropped."""
+		deadline = None if timeout is None else time.time()+timeout
+		stored = 0
+		with self.lock:
+			while stored < len(rows) and not self.closed:
+				free = self.capacity-self.count
+				if free == 0:
+					if not self._wait(self.not_full, deadline):
+						break
+					continue
+				n = min(free, len(rows)-stored)
+				tail = (self.head+self.count) % self.capacity
+				first = min(n, self.capacity-tail) #rows before wrapping
+				self.buf[tail:tail+first] = rows[stored:stored+first]
+				self.buf[:n-first] = rows[stored+first:stored+n]
+				self.times[tail:tail+first] = times[stored:stored+first]
+				self.times[:n-first] = times[stored+first:stored+n]
+				self.count += n
+				stored += n
+				self.not_empty.notify()
+			self.dropped += len(rows)-stored
+		return stored
+
+	def get(self, max_rows, timeout=None):
+		"""removes and returns up to max_rows of the oldest rows and their
+		times as new arrays. Waits up to timeout for data, returns empty
+		arrays if there is none or None once the buffer is closed and
+		drained."""
+		deadline = None if timeout is None else time.time()+timeout
+		with self.lock:
+			while self.count == 0:
+				if self.closed:
+					return None
+				if not self._wait(self.not_empty, deadline):
+					return self.buf[:0].copy(), self.times[:0].copy()
+			n = min(max_rows, self.count)
+			index = np.arange(self.head, self.head+n) % self.capacity
+			rows = self.buf.take(index, axis=0)
+			times = self.times.take(index)
+			self.head = (self.head+n) % self.capacity
+			self.count -= n
+			self.not_full.notify()
+		return rows, times
+
+	def close(self):
+		"""wakes everyone up, put() stops storing and get() returns None once
+		the remaining rows are drained"""
+		with self.lock:
+			self.closed = True
+			self.not_empty.notify_all()
+			self.not_full.notify_all()
+
+class Pipeline(object):
+	"""reads eye.readBlock() in one thread and passes batches of at most
+	batch rows to handler(rows, times) in another. times are the monotonic
+	timestamps of the samples (see timing.py). put_timeout is the longest the
+	reader waits on a full buffer before dropping samples; keep it well under
+	what the card's own buffer can hold."""
+	def __init__(self, eye, handler, capacity=2**20, batch=2**14, put_timeout=0.5, loop_stats=None):
+		self.eye = eye
+		self.handler = handler
+		self.ring = RingBuffer(capacity)
+		self.batch = batch
+		self.put_timeout = put_timeout
+		self.samples_read = 0
+		self.samples_written = 0
+		self.loop_stats = timing.LoopStats() if loop_stats is None else loop_stats
+		self.error = None
+		self.running = False
+		self.threads = []
+
+	def _stamp(self, t, n):
+		#times of the n samples of a read that returned at t. Clocked samples
+		#are spaced by the sample period, ending at the read.
+		if self.eye.rate is None:
+			return np.repeat(t, n)
+		return t-np.arange(n-1, -1, -1)/float(self.eye.rate)
+
+	def _acquire(self):
+		try:
+			while self.running:
+				block = self.eye.readBlock()
+				t = timing.monotonic()
+				self.loop_stats.update(t, len(block))
+				self.samples_read += len(block)
+				self.ring.put(block, self._stamp(t, len(block)), self.put_timeout)
+		except Exception as e:
+			self.error = e
+		finally:
+			self.ring.close()
+
+	def _write(self):
+		try:
+			while True:
+				batch = self.ring.get(self.batch, timeout=1.0)
+				if batch is None:
+					break
+				rows, times = batch
+				if len(rows):
+					self.handler(rows, times)
+					self.samples_written += len(rows)
+		except Exception as e:
+			self.error = e
+			self.running = False
+			self.ring.close()
+
+	def start(self):
+		self.running = True
+		self.threads = [threading.Thread(target=self._acquire, name="acquire"),
+		                threading.Thread(target=self._write, name="write")]
+		for t in self.threads:
+			t.daemon = True
+			t.start()
+
+	def stop(self):
+		"""stops reading, lets the writer drain the buffer and waits for both
+		threads"""
+		self.running = False
+		for t in self.threads:
+			t.join()
+
+	def alive(self):
+		return all(t.is_alive() for t in self.threads)
+
+	def stats(self):
+		"""sample counts and loop timing, cheap enough to call while running"""
+		stats = self.loop_stats.snapshot()
+		stats.update({"read":self.samples_read, "written":self.samples_written,
+		              "dropped":self.ring.dropped, "buffered":len(self.ring)})
+		return stats
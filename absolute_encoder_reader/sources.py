@@ -0,0 +1,65 @@
+import numpy as np
+import decoder
+import getData
+import capture
+"""
+encoder sources that run without the NI card
+
+Both classes are getData backends, so Eyeball(backend=...) behaves exactly
+like the card (single reads, or clocked blocks when a rate is given):
+
+SyntheticBackend - generates a spinning azimuth, a slowly nodding elevation
+                   and a free running 24 bit counter
+ReplayBackend    - plays back raw port bytes captured earlier
+"""
+
+class SyntheticBackend(getData.FakeBackend):
+	"""az spins at spin_rpm, el nods by el_amplitude degrees around el_center
+	with period el_period seconds and the counter advances counter_rate
+	counts per second. rate is the assumed sample rate when start() is not
+	given one. With paced=True reads take as long as the card would."""
+	def __init__(self, spin_rpm=1.0, el_center=45., el_amplitude=5., el_period=600.,
+	             counter_rate=1e6, rate=1000., paced=False):
+		self.spin_rpm = spin_rpm
+		self.el_center = el_center
+		self.el_amplitude = el_amplitude
+		self.el_period = el_period
+		self.counter_rate = counter_rate
+		self.default_rate = rate
+		self.paced = paced
+		self.pos = 0
+		self.rate = None
+		self.t_next = None
+
+	def start(self, rate=None, buffer_size=None):
+		getData.FakeBackend.start(self, rate or self.default_rate, buffer_size)
+
+	def samples_at(self, index):
+		"""(N, LINES) line bytes for the given sample numbers"""
+		t = index/float(self.rate)
+		az = (t*self.spin_rpm/60.*decoder.AZ_CODES).astype(np.int64) % decoder.AZ_CODES
+		el_deg = self.el_center+self.el_amplitude*np.sin(2*np.pi*t/self.el_period)
+		el = (el_deg/360.*40000).astype(np.int64) % 40000
+		rev = (t*self.counter_rate).astype(np.int64) % decoder.REV_CODES
+		return decoder.encode(el, az, rev)
+
+	def read(self, out, timeout=10.0):
+		n = out.shape[0]
+		self.wait(n)
+		out[:] = self.samples_at(np.arange(self.pos, self.pos+n))
+		self.pos += n
+		return n
+
+class ReplayBackend(getData.FakeBackend):
+	"""plays back raw line bytes, either a capture.py capture, an (M, LINES)
+	.npy file or a flat file of uint8 line bytes, looping at the end"""
+	def __init__(self, path, paced=False):
+		with open(path, 'rb') as f:
+			is_capture = f.read(len(capture.MAGIC)) == capture.MAGIC
+		if is_capture:
+			samples = capture.open_capture(path)[1]
+		elif path.endswith(".npy"):
+			samples = np.load(path, mmap_mode='r')
+		else:
+			samples = np.fromfile(path, dtype=np.uint8)
+		getData.FakeBackend.__init__(self, samples, paced)
@@ -0,0 +1,85 @@
+import sys
+import time
+import threading
+import ctypes
+import numpy as np
+"""
+sample timestamps and acquisition loop statistics
+
+Samples are stamped with monotonic() which never jumps with NTP or clock
+changes. LoopStats keeps a (utc, monotonic) anchor pair taken together at
+start up, so utc = utc_anchor + (t - monotonic_anchor).
+"""
+
+def _linux_monotonic():
+	#python 2 has no time.monotonic, call clock_gettime directly
+	class timespec(ctypes.Structure):
+		_fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+	librt = ctypes.CDLL("librt.so.1", use_errno=True)
+	clock_gettime = librt.clock_gettime
+	clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+	ts = timespec()
+	CLOCK_MONOTONIC = 1
+	def monotonic():
+		clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+		return ts.tv_sec+ts.tv_nsec*1e-9
+	return monotonic
+
+if hasattr(time, "monotonic"):
+	monotonic = time.monotonic
+elif sys.platform == "win32":
+	monotonic = time.clock #QueryPerformanceCounter on windows
+else:
+	try:
+		monotonic = _linux_monotonic()
+	except (OSError, AttributeError):
+		monotonic = time.time
+
+#read to read interval histogram bins, 1 us to 10 s, 4 per decade
+INTERVAL_BINS = np.logspace(-6, 1, 29)
+
+class LoopStats(object):
+	"""running statistics of the acquisition loop. update() is called by the
+	reading thread after every read, snapshot() can be called from any other
+	thread at any time."""
+	def __init__(self):
+		self.utc_anchor = time.time()
+		self.monotonic_anchor = monotonic()
+		self.lock = threading.Lock()
+		self.samples = 0
+		self.reads = 0
+		self.t_first = None
+		self.t_last = None
+		self.max_stall = 0.
+		self.hist = np.zeros(len(INTERVAL_BINS)+1, dtype=np.int64)
+
+	def update(self, t, n):
+		"""records a read of n samples that returned at monotonic time t"""
+		with self.lock:
+			if self.t_last is None:
+				self.t_first = t
+			else:
+				interval = t-self.t_last
+				self.hist[np.searchsorted(INTERVAL_BINS, interval)] += 1
+				self.max_stall = max(self.max_stall, interval)
+			self.t_last = t
+			self.samples += n
+			self.reads += 1
+
+	def rate(self):
+		"""mean samples per second since the first read"""
+		if self.t_last is None or self.t_last == self.t_first:
+			return 0.
+		return self.samples/(self.t_last-self.t_first)
+
+	def to_utc(self, t):
+		"""converts monotonic times to unix time"""
+		return self.utc_anchor+(t-self.monotonic_anchor)
+
+	def snapshot(self):
+		"""a copy of the current statistics as a dict"""
+		with self.lock:
+			return {"samples":self.samples, "reads":self.reads, "rate":self.rate(),
+			        "max_stall":self.max_stall, "interval_hist":self.hist.copy(),
+			        "interval_bins":INTERVAL_BINS, "utc_anchor":self.utc_anchor,
+			        "monotonic_anchor":self.monotonic_anchor}
@@ -0,0 +1,78 @@
+import sys
+import time
+import threading
+from simulator import Simulator
+from galil import Galil
+from pipelined import PipelinedGalil
+
+"""Benchmarks the galil clients against the simulator.
+
+    python benchmark.py [latency ms] [jitter ms] [commands]
+
+For every client class this reports sequential and concurrent commands per
+second, the latency of a full status() snapshot and the time scan() takes
+to move to the start of its path and begin streaming it. A fresh simulator
+is started for every client.
+"""
+
+CLIENTS = [Galil, PipelinedGalil]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values)-1, int(q*len(values)))]
+
+def commands_per_second(galil, n, threads=1):
+    """Rate of get_position calls spread over threads callers."""
+    def work():
+        for i in xrange(n//threads):
+            galil.get_position()
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    t = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (n//threads)*threads/(time.time()-t)
+
+def status_latency(galil, n):
+    """Seconds per status() call, as a list."""
+    times = []
+    for i in xrange(n):
+        t = time.time()
+        galil.status()
+        times.append(time.time()-t)
+    return times
+
+def scan_upload(galil):
+    t = time.time()
+    scan = galil.scan(0, 1, 10, 1)
+    while scan.running and not scan.sent: #slewing in the background
+        time.sleep(0.001)
+    elapsed = time.time()-t
+    scan.stop()
+    return elapsed
+
+def run(latency=0.001, jitter=0., n=200, clients=CLIENTS):
+    print "latency {:.1f} ms, jitter {:.1f} ms, {} commands".format(latency*1e3, jitter*1e3, n)
+    print "{:<16}{:>10}{:>12}{:>12}{:>12}{:>12}".format(
+        "client", "cmd/s", "cmd/s x4", "status ms", "p99 ms", "scan ms")
+    for cls in clients:
+        sim = Simulator(latency=latency, jitter=jitter).start()
+        galil = cls(sim.host, sim.port)
+        try:
+            sequential = commands_per_second(galil, n)
+            concurrent = commands_per_second(galil, n, threads=4)
+            status = status_latency(galil, max(n//10, 1))
+            scan = scan_upload(galil)
+        finally:
+            galil.close(False)
+            sim.stop()
+        print "{:<16}{:>10.0f}{:>12.0f}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+            cls.__name__, sequential, concurrent, 1e3*sum(status)/len(status),
+            1e3*percentile(status, 0.99), 1e3*scan)
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1])/1000. if len(sys.argv) > 1 else 0.001
+    jitter = float(sys.argv[2])/1000. if len(sys.argv) > 2 else 0.
+    n = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    run(latency, jitter, n)
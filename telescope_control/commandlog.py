@@ -0,0 +1,126 @@
+import bisect
+import json
+import re
+import threading
+import time
+
+"""Latency statistics and wire traces of galil commands.
+
+Commands are grouped by type, the two letter opcode, or the operand for
+messages like "MG _BGA" so that every "MG _BG" query lands in one group.
+"""
+
+#Upper edges of the latency histogram bins in seconds, four per decade from
+#0.1 ms to 10 s. One more bin counts everything slower.
+LATENCY_BINS = [1e-4*10**(i/4.) for i in range(21)]
+
+#Commands which always answer with a value, an empty reply is suspicious.
+QUERIES = ("TP", "MG", "TC", "QZ", "WH")
+
+COMMAND_TYPE = re.compile(r"\s*(MG\s*_[A-Z]{2}|[A-Z]{2}|\S*)")
+
+def command_type(cmd):
+    return COMMAND_TYPE.match(cmd).group(1)
+
+class CommandStats(object):
+    """Counts, latency histograms, timeouts, rejections, empty replies and
+    retries for every command type. Safe to update from several threads."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {}
+
+    def __entry(self, cmd):
+        kind = command_type(cmd)
+        entry = self.types.get(kind)
+        if entry is None:
+            entry = self.types[kind] = {"count": 0, "errors": 0, "timeouts": 0,
+                                        "empty": 0, "retries": 0, "total": 0.,
+                                        "max": 0., "hist": [0]*(len(LATENCY_BINS)+1)}
+        return entry
+
+    def record(self, cmd, latency, ok=True, reply=""):
+        """Records a response to cmd which took latency seconds."""
+        with self.lock:
+            entry = self.__entry(cmd)
+            entry["count"] += 1
+            entry["total"] += latency
+            entry["max"] = max(entry["max"], latency)
+            entry["hist"][bisect.bisect_left(LATENCY_BINS, latency)] += 1
+            if not ok:
+                entry["errors"] += 1
+            elif not reply and cmd.lstrip()[:2] in QUERIES:
+                entry["empty"] += 1
+
+    def record_timeout(self, cmd):
+        with self.lock:
+            self.__entry(cmd)["timeouts"] += 1
+
+    def record_retry(self, cmd):
+        with self.lock:
+            self.__entry(cmd)["retries"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.types = {}
+
+    def summary(self):
+        """Returns {command type: dict} with the counters plus the mean,
+        max, p50 and p99 latency in seconds. Percentiles are the upper edge
+        of the histogram bin they fall in."""
+        with self.lock:
+            types = dict((k, dict(v, hist=list(v["hist"]))) for k, v in self.types.items())
+        for entry in types.values():
+            n = entry["count"]
+            entry["mean"] = entry["total"]/n if n else 0.
+            for name, q in (("p50", 0.5), ("p99", 0.99)):
+                entry[name] = percentile(entry["hist"], q, entry["max"])
+        return types
+
+    def report(self):
+        """The summary as a table, slowest p99 first."""
+        lines = ["{:<10}{:>8}{:>9}{:>9}{:>9}{:>6}{:>6}{:>6}{:>6}".format(
+            "command", "count", "mean ms", "p99 ms", "max ms", "err", "tmo", "empty", "retry")]
+        summary = self.summary()
+        for kind in sorted(summary, key=lambda k: -summary[k]["p99"]):
+            e = summary[kind]
+            lines.append("{:<10}{:>8}{:>9.2f}{:>9.2f}{:>9.2f}{:>6}{:>6}{:>6}{:>6}".format(
+                kind, e["count"], 1e3*e["mean"], 1e3*e["p99"], 1e3*e["max"],
+                e["errors"], e["timeouts"], e["empty"], e["retries"]))
+        return "\n".join(lines)
+
+def percentile(hist, q, largest):
+    """The upper edge of the bin holding the q quantile of hist, never more
+    than largest."""
+    n = sum(hist)
+    if not n:
+        return 0.
+    seen = 0
+    for edge, count in zip(LATENCY_BINS+[largest], hist):
+        seen += count
+        if seen >= q*n:
+            return min(edge, largest)
+    return largest
+
+class Tracer(object):
+    """Writes every chunk of bytes sent ("tx") or received ("rx") as a line
+    of json with its time.time(), for example
+        {"t": 1380000000.123456, "dir": "tx", "data": "TP;"}
+    out is a file name, opened for appending, or a file like object."""
+    def __init__(self, out):
+        self.out = open(out, "a") if isinstance(out, basestring) else out
+        self.lock = threading.Lock()
+
+    def __call__(self, direction, data):
+        #latin-1 maps every byte to one character, so binary replies survive
+        line = json.dumps({"t": time.time(), "dir": direction,
+                           "data": data.decode("latin-1")})
+        with self.lock:
+            if self.out is not None: #late traffic after close is dropped
+                self.out.write(line+"\n")
+                self.out.flush()
+
+    def close(self):
+        with self.lock:
+            out, self.out = self.out, None
+        if out is not None:
+            out.close()
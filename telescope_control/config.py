@@ -35,12 +35,15 @@ class Config(OrderedDict):
     b the int 1234. If it is more convenient to denote a value in some other
     common base, either 2, 8, or 16, then you may write things like
     "key b10100111" or "key xFF0088" or "key o70312" (the last one is octal.)
-    You may also write a floating point decimal like "key 1234.5678". This must
-    be in base 10!
+    You may also write a floating point decimal like "key 1234.5678" or
+    "key -1.5e-05". This must be in base 10! Setting a key the file does not
+    have yet adds it to the end of the file.
     """
     def __init__(self, fname):
         """fname is the filename for the configuration file"""
         self.fname = fname
+        #bumped on every change, so users can tell when to re-read values
+        self.generation = 0
         OrderedDict.__init__(self, self.__get_current_state())
 
     def __get_current_state(self):
@@ -76,11 +79,11 @@ class Config(OrderedDict):
 
     def __type_check(self, val):
         #Type checks the val and converts to the correct value
-        checks = [(re.compile("[0-9]+"), int), #decimal
+        checks = [(re.compile("-?[0-9]+"), int), #decimal
                   (re.compile("x[0-9A-Fa-f]+"), lambda x: int(x[1:], 16)), #hex
                   (re.compile("o[0-7]+"), lambda x: int(x[1:], 8)), #octal
                   (re.compile("b[01]+"), lambda x: int(x[1:], 2)), #binary
-                  (re.compile("[0-9]+.[0-9]+"), float), #decimal float
+                  (re.compile(r"-?[0-9]+(\.[0-9]*)?([eE][-+]?[0-9]+)?"), float), #decimal float
                   (re.compile("True|False"), eval),  #python and scheme-style bool
                   (re.compile("#t|#f"), lambda x: True if x=="#t" else False)]
         for pattern, func in checks:
@@ -112,15 +115,16 @@ class Config(OrderedDict):
         #the actual list value associated with the key is replaced
         #not just the value the user is allowed to see. This is
         #because I have not added "list" typechecking logic yet.
+        self.generation += 1
         if isinstance(val, list):
             self.__setitem(key, val)
         else:
-            #also, I did not add logic for when you try to
-            #create a new key, TODO!
             if key in self:
                 vals = self.__getitem(key) #get the val, comment list
                 vals[0] = val #change the val
                 self.__setitem(key, vals) #add the change
+            else: #a new key, without a comment
+                self.__setitem(key, [val])
             with open(self.fname, 'w') as f:
                 #rewrite every key val #comment to file
                 for k in self:
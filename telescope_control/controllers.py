@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from pipelined import PipelinedGalil
+
+"""Several galil controllers driven from one process.
+
+The controllers are listed in the config file by name, each with its own
+address, for example
+
+    CONTROLLERS mount,stage
+    mount_IP 192.168.1.10
+    mount_PORT 23
+    stage_IP 192.168.1.11
+    stage_PORT 23
+    stage_AXES 1
+
+Without a CONTROLLERS line the IP and PORT keys make a single controller
+called "galil".
+"""
+
+class ControllerPool(object):
+    def __init__(self, controllers, cls=PipelinedGalil, poll=10, check=1.0,
+                 stale=3.0, **kwargs):
+        """controllers maps a name to (ip, port, axes), an OrderedDict keeps
+        the order for names(). Every controller is
+        a cls (extra keyword arguments are passed on) polling its status
+        poll times a second, so all of them poll concurrently.
+
+        Every check seconds the pool reconnects the controllers which have
+        not produced a status in the last stale seconds, which should be
+        longer than the command timeout, and the ones that could not be
+        reached at all."""
+        self.controllers = controllers
+        self.cls = cls
+        self.poll = poll
+        self.stale = stale
+        self.kwargs = kwargs
+        self.galils = dict((name, None) for name in controllers)
+        self.connected = {} #time of the last (re)connection
+        self.errors = {} #the last connection error of each controller
+        self.lock = threading.Lock()
+        self.__parallel(self.__connect, list(controllers))
+        self.running = True
+        self.monitor = threading.Thread(target=self.__monitor, args=(check,),
+                                        name="controller monitor")
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        if "CONTROLLERS" not in config:
+            return cls({"galil": (config["IP"], config["PORT"], 2)}, **kwargs)
+        names = str(config["CONTROLLERS"]).split(',')
+        controllers = OrderedDict()
+        for name in names:
+            axes = config[name+"_AXES"] if name+"_AXES" in config else 2
+            controllers[name] = (config[name+"_IP"], config[name+"_PORT"], axes)
+        return cls(controllers, **kwargs)
+
+    def __getitem__(self, name):
+        """The Galil called name, None while it is not connected."""
+        return self.galils[name]
+
+    def names(self):
+        return list(self.controllers)
+
+    def __parallel(self, func, names):
+        """Calls func(name) for every name at once, returns {name: result}
+        where the result is the exception instance if func raised."""
+        results = {}
+        def call(name):
+            try:
+                results[name] = func(name)
+            except Exception as e:
+                results[name] = e
+        threads = [threading.Thread(target=call, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def __connect(self, name):
+        ip, port, axes = self.controllers[name]
+        try:
+            galil = self.galils[name]
+            if galil is None:
+                galil = self.cls(ip, port, poll=self.poll, axes=axes, **self.kwargs)
+            else:
+                galil.reconnect()
+        except Exception as e:
+            self.errors[name] = e
+            raise
+        with self.lock:
+            self.galils[name] = galil
+            self.connected[name] = time.time()
+        self.errors.pop(name, None)
+        return galil
+
+    def healthy(self, name):
+        """True if the controller answered a status poll in the last stale
+        seconds, or was (re)connected less than stale seconds ago."""
+        galil = self.galils[name]
+        if galil is None or galil.con is None:
+            return False
+        snapshot = galil.snapshot
+        last = max(snapshot.t if snapshot else 0, self.connected.get(name, 0))
+        return time.time()-last < self.stale
+
+    def health(self):
+        """{name: healthy(name)} for every controller."""
+        return dict((name, self.healthy(name)) for name in self.controllers)
+
+    def __monitor(self, check):
+        while self.running:
+            time.sleep(check)
+            if not self.running:
+                break
+            sick = [name for name, ok in self.health().items() if not ok]
+            if sick:
+                self.__parallel(self.__connect, sick)
+
+    def snapshots(self):
+        """{name: the controller's latest Status}, None where there is none."""
+        with self.lock:
+            galils = dict(self.galils)
+        return dict((name, galil and galil.snapshot) for name, galil in galils.items())
+
+    def fan_out(self, method, *args):
+        """Calls method(*args) on every connected controller at once and
+        returns {name: result}, the exception instance where it failed.
+        Takes one round trip, not one per controller."""
+        with self.lock:
+            galils = dict((name, g) for name, g in self.galils.items() if g is not None)
+        return self.__parallel(lambda name: getattr(galils[name], method)(*args), list(galils))
+
+    def stop_all(self):
+        return self.fan_out("end_motion")
+
+    def motors_off(self):
+        return self.fan_out("motor_off")
+
+    def send_all(self, cmd):
+        """Sends the same command to every controller."""
+        return self.fan_out("send_read", cmd)
+
+    def close(self, motors_off=True):
+        self.running = False
+        self.monitor.join()
+        with self.lock:
+            galils = [g for g in self.galils.values() if g is not None]
+        for galil in galils:
+            galil.close(motors_off)
@@ -0,0 +1,189 @@
+import os
+import sys
+import math
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+import ephem
+from sky import file_times
+
+"""Finds the times a planet or the Moon passed through the beam.
+
+The encoder archive (root/MM-DD-YYYY/HH-MM.h5, az and el in degrees) is
+read a chunk at a time. The body's position is computed with PyEphem only
+on a coarse time grid, as a unit vector. It is interpolated linearly to
+every sample, and the angular separation from boresight is one vectorized
+dot product. With the default 60 s grid the interpolation error is below
+an arcsecond for the Moon.
+
+    python crossings.py config.txt root Moon [radius degrees]
+"""
+
+UNIX_EPOCH = ephem.Date("1970/1/1")
+
+#start and stop are unix times, closest is the smallest separation in
+#degrees, reached at t_closest.
+Crossing = namedtuple("Crossing", "start stop closest t_closest")
+
+def unit_vectors(az, el):
+    """(east, north, up) components of directions in degrees."""
+    az, el = np.radians(az), np.radians(el)
+    return np.cos(el)*np.sin(az), np.cos(el)*np.cos(az), np.sin(el)
+
+class BodyTrack(object):
+    """The direction of body seen from lat/lon on a grid of step seconds,
+    computed on demand and cached."""
+    def __init__(self, body, lat, lon, step=60.):
+        self.body = getattr(ephem, body)() if isinstance(body, basestring) else body
+        self.observer = ephem.Observer()
+        self.observer.lat, self.observer.lon = lat, lon
+        self.observer.pressure = 0
+        self.step = step
+        self.cache = {}
+
+    def __point(self, i):
+        if i not in self.cache:
+            self.observer.date = ephem.Date(UNIX_EPOCH+i*self.step/86400.)
+            self.body.compute(self.observer)
+            self.cache[i] = unit_vectors(math.degrees(self.body.az), math.degrees(self.body.alt))
+        return self.cache[i]
+
+    def vectors(self, t):
+        """Interpolated (east, north, up) arrays at the unix times t."""
+        first = int(math.floor(t.min()/self.step))
+        last = int(math.floor(t.max()/self.step))+1
+        grid = np.arange(first, last+1)
+        points = np.array([self.__point(i) for i in grid])
+        if len(self.cache) > 4*len(grid)+1000: #keep the cache bounded
+            self.cache = dict((i, self.cache[i]) for i in grid)
+        x, y, z = [np.interp(t, grid*self.step, points[:, k]) for k in range(3)]
+        #interpolating shortens the vectors a little, which arccos notices
+        norm = np.sqrt(x*x+y*y+z*z)
+        return x/norm, y/norm, z/norm
+
+def cos_separation(az, el, vectors):
+    """Cosine of the angle between boresight az/el and the body vectors."""
+    x, y, z = unit_vectors(az, el)
+    return np.clip(x*vectors[0]+y*vectors[1]+z*vectors[2], -1., 1.)
+
+def separation(az, el, vectors):
+    """Angle in degrees between boresight az/el and the body vectors."""
+    return np.degrees(np.arccos(cos_separation(az, el, vectors)))
+
+def runs(mask):
+    """(start, stop) index pairs of the runs of True in mask, stop excluded."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+def archive_files(root):
+    """The archive's files in time order."""
+    files = []
+    for day in os.listdir(root):
+        directory = os.path.join(root, day)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith(".h5"):
+                try:
+                    t = time_of(day, name)
+                except ValueError: #not an archive file
+                    continue
+                files.append((t, os.path.join(directory, name)))
+    return [path for t, path in sorted(files)]
+
+def time_of(day, name):
+    month, mday, year = map(int, day.split("-"))
+    hour, minute = map(int, name[:-len(".h5")].split("-"))
+    return (year, month, mday, hour, minute)
+
+def file_crossings(path, track, radius, chunk=2**18, anchor=None, start=None):
+    """Crossings within radius degrees in one archive file. Times come from
+    sky.file_times, anchor and start are passed on to it."""
+    import h5py
+    found = []
+    threshold = math.cos(math.radians(radius)) #arccos only inside crossings
+    with h5py.File(path, 'r') as h5file:
+        times = file_times(h5file, path, anchor, start)
+        data = h5file["data"]
+        for i in range(0, len(data), chunk):
+            rows = data[i:i+chunk]
+            t = times(rows, i)
+            ok = ~np.isnan(t)
+            if not ok.any():
+                continue
+            t, az, el = t[ok], rows["az"][ok], rows["el"][ok]
+            cos = cos_separation(az, el, track.vectors(t))
+            for start, stop in runs(cos > threshold):
+                closest = start+int(np.argmax(cos[start:stop]))
+                found.append(Crossing(t[start], t[stop-1], math.degrees(math.acos(cos[closest])),
+                                      t[closest]))
+    return found
+
+def merge(crossings, gap):
+    """Joins crossings less than gap seconds apart."""
+    merged = []
+    for c in sorted(crossings):
+        if merged and c.start-merged[-1].stop < gap:
+            last = merged[-1]
+            best = last if last.closest <= c.closest else c
+            merged[-1] = Crossing(last.start, max(last.stop, c.stop), best.closest, best.t_closest)
+        else:
+            merged.append(c)
+    return merged
+
+def _search(path, track, radius, chunk):
+    """(crossings, None) for one file, or ([], the error) if it could not
+    be read."""
+    try:
+        return file_crossings(path, track, radius, chunk), None
+    except Exception as e:
+        return [], "{}: {}".format(type(e).__name__, e)
+
+def _worker(args):
+    """Crossings in one file, for a process pool."""
+    path, body, lat, lon, radius, step, chunk = args
+    return (path,)+_search(path, BodyTrack(body, lat, lon, step), radius, chunk)
+
+def find_crossings(paths, body, lat, lon, radius=1., step=60., gap=1., chunk=2**18,
+                   processes=None, skipped=None):
+    """Crossings of body (a name like "Moon" or an ephem body) within
+    radius degrees of boresight in the archive files paths (or the root
+    directory of the archive). Crossings less than gap seconds apart, e.g.
+    split by a file boundary, are joined.
+
+    Files are searched by a pool of processes (default one per cpu) when
+    body is given by name, processes=1 searches them in this process.
+    Files that cannot be read are skipped and reported on stderr, and
+    appended to skipped as (path, error) if it is a list."""
+    if isinstance(paths, basestring):
+        paths = archive_files(paths)
+    found = []
+    pool = None
+    if processes == 1 or not isinstance(body, basestring):
+        track = BodyTrack(body, lat, lon, step)
+        results = ((path,)+_search(path, track, radius, chunk) for path in paths)
+    else:
+        pool = multiprocessing.Pool(processes)
+        jobs = [(path, body, lat, lon, radius, step, chunk) for path in paths]
+        results = pool.imap(_worker, jobs)
+    for path, crossings, error in results:
+        if error is not None:
+            sys.stderr.write("skipped {}: {}\n".format(path, error))
+            if skipped is not None:
+                skipped.append((path, error))
+        found.extend(crossings)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return merge(found, gap)
+
+if __name__ == "__main__":
+    import time
+    from config import Config
+    config = Config(sys.argv[1])
+    radius = float(sys.argv[4]) if len(sys.argv) > 4 else 1.
+    for c in find_crossings(sys.argv[2], sys.argv[3], str(config["LAT"]), str(config["LON"]), radius):
+        print "{} - {} closest {:.3f} deg at {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(c.start)),
+            time.strftime("%H:%M:%S", time.gmtime(c.stop)), c.closest,
+            time.strftime("%H:%M:%S", time.gmtime(c.t_closest)))
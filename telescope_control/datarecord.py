@@ -0,0 +1,116 @@
+import socket
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+#One data record as pushed by the controller. t is the time.time() it was
+#received, sample is the controller's sample counter and axes holds an
+#AxisRecord for each axis.
+DataRecord = namedtuple("DataRecord", "t sample axes")
+AxisRecord = namedtuple("AxisRecord", "status switches stop_code reference "
+                                      "position error aux velocity torque")
+
+#The leading fields of every axis block (DMC-40x0 layout), the rest of the
+#block is skipped.
+AXIS_FORMAT = "HBBllllll"
+
+def record_struct(axes, general, coord, axis):
+    """Compiles the struct for a record with the block sizes QZ reports.
+    The general block starts with the 4 byte header and the sample number."""
+    skip = axis-struct.calcsize("<"+AXIS_FORMAT)
+    fmt = "<4xH{}x{}x".format(general-6, coord)
+    fmt += (AXIS_FORMAT+"{}x".format(skip))*axes
+    return struct.Struct(fmt)
+
+class DataRecordStream(object):
+    """Receives the binary data records (DR) a galil pushes on a second
+    connection and keeps the latest one plus a history of the last history
+    records. galil is the Galil the DR command is sent through, period is
+    the number of servo samples (normally ms) between records."""
+    def __init__(self, galil, ip, port, period=1, history=10000):
+        self.galil = galil
+        self.history = deque(maxlen=history)
+        self.latest = None
+        self.received = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+        axes, general, coord, axis = galil.send_read("QZ").split(',')
+        self.axes = int(axes)
+        self.struct = record_struct(self.axes, int(general), int(coord), int(axis))
+
+        self.sock = socket.create_connection((ip, port), galil.timeout)
+        #Find which handle this connection is, the galil answers "IHB" etc.
+        self.sock.sendall("WH;")
+        self.handle = self.__read_ascii().strip()[-1]
+        self.sock.settimeout(None)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="data records")
+        self.thread.daemon = True
+        self.thread.start()
+        self.galil.send_read("DR {},{}".format(period, ord(self.handle)-65))
+
+    def __read_ascii(self):
+        reply = ""
+        while not reply.endswith(":"):
+            chunk = self.sock.recv(1)
+            if not chunk:
+                raise socket.error("connection closed")
+            reply += chunk
+        return reply[:-1]
+
+    def __read_exact(self, n):
+        data = ""
+        while len(data) < n:
+            chunk = self.sock.recv(n-len(data))
+            if not chunk:
+                raise socket.error("connection closed")
+            data += chunk
+        return data
+
+    def __run(self):
+        size = self.struct.size
+        fields = len(AXIS_FORMAT)
+        try:
+            while self.running:
+                header = self.__read_exact(4)
+                length = struct.unpack("<H", header[2:4])[0]
+                data = header+self.__read_exact(length-4)
+                t = time.time()
+                values = self.struct.unpack(data[:size])
+                axes = tuple(AxisRecord(*values[1+i*fields:1+(i+1)*fields])
+                             for i in range(self.axes))
+                record = DataRecord(t, values[0], axes)
+                with self.lock:
+                    self.latest = record
+                    self.history.append(record)
+                    self.received += 1
+        except (socket.error, struct.error) as e:
+            if self.running:
+                self.error = e
+
+    def get_history(self, since=None):
+        """Returns a list of the buffered records, only those received after
+        time since if it is given."""
+        with self.lock:
+            records = list(self.history)
+        if since is not None:
+            records = [r for r in records if r.t > since]
+        return records
+
+    def close(self):
+        """Stops the controller sending records and closes the connection."""
+        if self.running:
+            self.running = False
+            try:
+                self.galil.send_read("DR 0,{}".format(ord(self.handle)-65))
+            finally:
+                #closing alone does not wake a recv() blocked in the thread
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error: #already closed by the controller
+                    pass
+                self.sock.close()
+                self.thread.join()
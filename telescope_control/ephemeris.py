@@ -0,0 +1,222 @@
+import math
+import threading
+import time
+from collections import namedtuple
+import ephem
+
+"""Precomputed az/el of a tracked ra/dec.
+
+PyEphem is only called on a coarse time grid. Positions and rates in
+between come from cubic Hermite interpolation of the grid, a few
+microseconds per lookup. A background thread computes the next table
+before the current one runs out.
+"""
+
+UNIX_EPOCH = ephem.Date("1970/1/1")
+
+#Tracker limits unless the config has TrackMaxRate and TrackMinEl, in
+#degrees per second and degrees.
+MAX_RATE = 2.
+MIN_EL = 10.
+
+#start is the unix time of the first row, step the spacing in seconds. az
+#is unwrapped, so it may leave 0-360. Rates are in degrees per second.
+Table = namedtuple("Table", "start step az el az_rate el_rate")
+
+class Ephemeris(object):
+    def __init__(self, lat, lon, ra, dec, span=600., step=1., margin=None):
+        """Tracks ra and dec (strings like 'h:m:s' and 'd:m:s', or radians)
+        from lat and lon. Every table covers span seconds at step second
+        intervals, and a new one is made when less than margin seconds
+        (default a quarter of span) are left."""
+        self.observer = ephem.Observer()
+        self.observer.lat, self.observer.lon = lat, lon
+        self.observer.pressure = 0
+        self.body = ephem.FixedBody()
+        self.body._ra, self.body._dec = ephem.hours(ra), ephem.degrees(dec)
+        self.span, self.step = span, step
+        self.margin = span/4. if margin is None else margin
+        self.lock = threading.Lock() #the observer and body are shared
+        self.table = None
+        self.refills = 0
+        self.misses = 0 #lookups outside the table, computed directly
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def compute(self, t):
+        """Exact (az, el) in degrees at unix time t."""
+        with self.lock:
+            self.observer.date = ephem.Date(UNIX_EPOCH+t/86400.)
+            self.body.compute(self.observer)
+            return math.degrees(self.body.az), math.degrees(self.body.alt)
+
+    def build(self, start):
+        """Computes a Table starting at unix time start."""
+        step = self.step
+        az, el = [], []
+        for i in range(int(math.ceil(self.span/step))+1):
+            a, e = self.compute(start+i*step)
+            if az: #unwrap, so interpolation never crosses a 360 jump
+                a += 360.*round((az[-1]-a)/360.)
+            az.append(a)
+            el.append(e)
+        return Table(start, step, az, el, rates(az, step), rates(el, step))
+
+    def at(self, t=None):
+        """(az, el, az_rate, el_rate) at unix time t, default now. az is in
+        0-360 degrees, rates are in degrees per second."""
+        t = time.time() if t is None else t
+        table = self.table
+        if table is not None:
+            x = (t-table.start)/table.step
+            i = int(math.floor(x))
+            if 0 <= i < len(table.az)-1:
+                u = x-i
+                az, az_rate = hermite(table.az, table.az_rate, i, u, table.step)
+                el, el_rate = hermite(table.el, table.el_rate, i, u, table.step)
+                return az % 360., el, az_rate, el_rate
+        self.misses += 1
+        (az0, el0), (az1, el1) = self.compute(t), self.compute(t+self.step)
+        return az0, el0, ((az1-az0+180.) % 360.-180.)/self.step, (el1-el0)/self.step
+
+    def start(self):
+        """Builds the first table and starts refilling, returns self."""
+        self.table = self.build(time.time())
+        self.running = True
+        self.thread = threading.Thread(target=self.__refill, name="ephemeris")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __refill(self):
+        while self.running:
+            table = self.table
+            now = time.time()
+            if table.start+(len(table.az)-1)*table.step-now < self.margin:
+                try:
+                    self.table = self.build(now)
+                    self.refills += 1
+                except Exception as e: #lookups fall back to compute()
+                    self.error = e
+            time.sleep(min(self.step, self.margin/4.))
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+def rates(values, step):
+    """Derivative of equally spaced values, central differences inside."""
+    if len(values) < 2:
+        return [0.]*len(values)
+    inner = [(values[i+1]-values[i-1])/(2*step) for i in range(1, len(values)-1)]
+    return ([(values[1]-values[0])/step]+inner+
+            [(values[-1]-values[-2])/step])
+
+def hermite(p, m, i, u, step):
+    """Value and derivative of the cubic through points i and i+1 of p with
+    slopes m, at fraction u of the way."""
+    p0, p1, m0, m1 = p[i], p[i+1], m[i]*step, m[i+1]*step
+    uu = u*u
+    value = ((2*uu*u-3*uu+1)*p0+(uu*u-2*uu+u)*m0+
+             (-2*uu*u+3*uu)*p1+(uu*u-uu)*m1)
+    slope = ((6*uu-6*u)*p0+(3*uu-4*u+1)*m0+
+             (-6*uu+6*u)*p1+(3*uu-2*u)*m1)
+    return value, slope/step
+
+class Tracker(object):
+    """Keeps axes A (az) and B (el) on an Ephemeris. The axes first slew to
+    the target at their SP speed, as ContourStreamer does. After that every
+    tick they jog at the table's rates plus gain times the position error,
+    so the mount follows the target smoothly between updates.
+
+    counts turns az and el degrees into (az, el) encoder counts (e.g.
+    Units.sky_to_encoder, which applies the pointing model), rate is the
+    number of updates per second. No jog is faster than max_rate degrees
+    per second, and tracking stops, with error set, when the target sinks
+    below min_el degrees."""
+    def __init__(self, galil, ephemeris, counts, rate=20., gain=1., max_rate=MAX_RATE,
+                 min_el=MIN_EL):
+        self.galil = galil
+        self.ephemeris = ephemeris
+        self.counts = counts
+        self.period = 1./rate
+        self.gain = gain
+        self.max_rate = max_rate
+        self.min_el = min_el
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Starts the slew and tracking in the background and returns self,
+        ValueError if the target is below min_el."""
+        el = self.ephemeris.at()[1]
+        if el < self.min_el:
+            raise ValueError("target elevation {:.2f} is below the {:.2f} degree limit".format(
+                el, self.min_el))
+        self.running = True
+        self.thread = threading.Thread(target=self.__track, name="tracker")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __settle(self):
+        while self.running and any(self.galil.in_motion(i) for i in (0, 1)):
+            time.sleep(0.05)
+        return self.running
+
+    def __slew(self, revolution):
+        """Moves to where the target is now, the short way round in
+        azimuth. False if stopped on the way."""
+        if not self.__settle():
+            return False
+        position = self.galil.get_position()
+        az, el = self.ephemeris.at()[:2]
+        target = self.counts(az, el)
+        az_target = target[0]+revolution*round((position[0]-target[0])/revolution)
+        self.galil.move_to(0, int(round(az_target)))
+        self.galil.move_to(1, int(round(target[1])))
+        self.galil.begin_motion()
+        return self.__settle()
+
+    def __track(self):
+        revolution = abs(self.counts(360., 0.)[0]-self.counts(0., 0.)[0])
+        az_limit = self.max_rate*revolution/360.
+        el_limit = self.max_rate*abs(self.counts(0., 1.)[1]-self.counts(0., 0.)[1])
+        clamp = lambda v, limit: int(round(max(-limit, min(limit, v))))
+        try:
+            if not self.__slew(revolution):
+                return
+            self.galil.batch("JGA=0", "JGB=0", "BGAB")
+            next_t = time.time()
+            while self.running:
+                position = self.galil.get_position()
+                az, el, az_rate, el_rate = self.ephemeris.at()
+                if el < self.min_el:
+                    raise ValueError("target set below the {:.2f} degree limit".format(self.min_el))
+                target = self.counts(az, el)
+                #counts per second, where the target will be a second on
+                ahead = self.counts(az+az_rate, el+el_rate)
+                az_error = target[0]-position[0]
+                #take the short way round in azimuth
+                az_error = (az_error+revolution/2.) % revolution-revolution/2.
+                el_error = target[1]-position[1]
+                self.galil.batch("JGA={}".format(clamp(ahead[0]-target[0]+self.gain*az_error, az_limit)),
+                                 "JGB={}".format(clamp(ahead[1]-target[1]+self.gain*el_error, el_limit)))
+                next_t = max(next_t+self.period, time.time())
+                time.sleep(max(0, next_t-time.time()))
+        except Exception as e:
+            self.error = e
+            self.galil.end_motion()
+        self.running = False
+
+    def stop(self):
+        """Stops tracking and the axes."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.galil.end_motion()
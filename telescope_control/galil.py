@@ -1,27 +1,220 @@
 from telnetlib import Telnet
-import math
 import time
+import re
+import threading
+import socket
+from collections import namedtuple
+from datarecord import DataRecordStream
+from commandlog import CommandStats, Tracer
+from trajectory import ContourStreamer, oscillation
+
+#The galil ends every response with a colon, or a question mark if it
+#could not execute the command.
+TERMINATOR = re.compile(r"[:?]")
+
+class GalilError(Exception):
+    """Raised when the galil rejects a command."""
+    def __init__(self, cmd, message=""):
+        Exception.__init__(self, "{!r} failed: {}".format(cmd, message))
+        self.cmd = cmd
+        self.message = message
+
+class GalilTimeout(GalilError):
+    """Raised when the galil does not finish a response in time."""
+    pass
+
+#A snapshot of every axis. position, in_motion and motor_on are tuples
+#indexed by axis, t is the time.time() the snapshot was taken.
+Status = namedtuple("Status", "t position in_motion motor_on")
+
+def parse_values(reply):
+    """Turns a response like '10, -20' or '1.0000' into an int/float or a
+    tuple of them, integral values become ints."""
+    values = [float(v) for v in reply.split(',')]
+    values = [int(v) if v.is_integer() else v for v in values]
+    return values[0] if len(values) == 1 else tuple(values)
+
+def parse_flag(reply):
+    """Turns a response like '1.0000' into a bool."""
+    return bool(float(reply))
 
 class Galil(object):
-    def __init__(self, ip, port, poll=False, queue=None):
-        """A class which facilitates interaction with the galil controller"""
+    def __init__(self, ip, port, poll=False, queue=None, timeout=1.0, axes=2,
+                 trace=None):
+        """A class which facilitates interaction with the galil controller.
+        timeout is how long to wait for a response, in seconds.
+
+        If poll is a rate in Hz (True means 10 Hz) a background thread keeps
+        self.snapshot, the latest Status, up to date. If queue is given too,
+        every snapshot that differs from the previous one is put on it.
+
+        Round trip latencies, rejections, timeouts, empty replies and retries
+        of every command type are kept in self.stats (a CommandStats). If
+        trace is a file name or file, every byte sent and received is logged
+        to it as json lines with timestamps."""
 
-        self.con = Telnet(ip, port)
+        self.ip, self.port = ip, port
+        self.timeout = timeout
+        self.axes = axes
         self.positions = [0, 0]
+        self.lock = threading.RLock() #one command/response exchange at a time
+        self.stats = CommandStats()
+        self.tracer = Tracer(trace) if trace is not None else None
+        self.sent = 0. #time.time() of the last write
+        self.con = self.connect(ip, port)
+        self.snapshot = None
+        self.poll_error = None
+        self.queue = queue
+        self.polling = False
+        self.poller = None
+        if poll:
+            self.start_polling(10.0 if poll is True else poll)
 
-    def send_read(self, cmd):
-        """Sends a galil command to the controller, then returns the result"""
+    def connect(self, ip, port):
+        """Opens and returns the command connection."""
+        con = Telnet(ip, port)
+        #commands are tiny writes, don't let Nagle hold them back
+        con.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return con
 
-        #First, we need to clear the input buffer, because we want to get rid of any previous strings
-        try:
-            self.con.read_very_eager()
-        except:
-            pass
-        self.con.write( cmd+';')           # send the command string
-        time.sleep(0.030)               # give some time for the galil to respond
+    def disconnect(self):
+        """Closes the command connection, leaving the motors alone."""
+        if self.con:
+            try:
+                self.con.close()
+            except:
+                pass
+            self.con = None
+
+    def reconnect(self):
+        """Replaces the command connection, e.g. after the controller was
+        power cycled. References to this Galil stay valid and polling
+        carries on."""
+        with self.lock:
+            self.disconnect()
+            self.con = self.connect(self.ip, self.port)
+
+    def send_read(self, cmd, timeout=None, retries=0):
+        """Sends a galil command to the controller, then returns the result
+        as soon as the terminator arrives. Raises GalilError if the command
+        is rejected, and GalilTimeout if there is no answer within timeout
+        seconds after retries more attempts."""
+        for attempt in range(retries+1):
+            try:
+                return self.exchange(cmd, timeout)
+            except GalilTimeout:
+                if attempt == retries:
+                    raise
+                self.stats.record_retry(cmd)
 
-        #get the response and strip off the garbage the galil sends to make interacting with it over telnet easier.
-        return self.con.read_very_eager().rstrip(":").strip()
+    def exchange(self, cmd, timeout=None):
+        """One attempt of send_read."""
+        with self.lock:
+            #First, we need to clear the input buffer, because we want to get rid of any previous strings
+            try:
+                self.con.read_very_eager()
+            except:
+                pass
+            self.__write(cmd+';')           # send the command string
+            return self.read_response(cmd, timeout)
+
+    def read_response(self, cmd, timeout=None):
+        """Waits for the response to cmd and returns it without the
+        terminator and the whitespace the galil pads it with."""
+        ok, reply = self.__read_one(cmd, timeout)
+        if not ok:
+            raise GalilError(cmd, self.error_message())
+        return reply
+
+    def __write(self, data):
+        if self.tracer:
+            self.tracer("tx", data)
+        self.con.write(data)
+        self.sent = time.time()
+
+    def __read_one(self, cmd, timeout):
+        """Reads up to the next terminator, returns (accepted, response)."""
+        timeout = self.timeout if timeout is None else timeout
+        index, match, text = self.con.expect([TERMINATOR], timeout)
+        if self.tracer and text:
+            self.tracer("rx", text)
+        if index == -1:
+            self.stats.record_timeout(cmd)
+            raise GalilTimeout(cmd, "no response after {} s".format(timeout))
+        ok, reply = match.group() == ":", text[:match.start()].strip()
+        self.stats.record(cmd, time.time()-self.sent, ok, reply) #since the write
+        return ok, reply
+
+    def batch(self, *cmds, **kwargs):
+        """Sends every command in a single write and returns their responses
+        in order. A command is either a string or a (string, parse) pair, in
+        which case parse(response) is returned instead. Every response is
+        read before a GalilError is raised for rejected commands. Takes the
+        same timeout keyword as send_read, applied to each response."""
+        timeout = kwargs.get("timeout")
+        cmds = [(cmd, None) if isinstance(cmd, str) else cmd for cmd in cmds]
+        with self.lock:
+            try:
+                self.con.read_very_eager()
+            except:
+                pass
+            self.__write(''.join(cmd+';' for cmd, parse in cmds))
+            replies = [self.__read_one(cmd, timeout) for cmd, parse in cmds]
+            failed = [cmd for (cmd, parse), (ok, reply) in zip(cmds, replies) if not ok]
+            if failed:
+                raise GalilError(';'.join(failed), self.error_message())
+        return [reply if parse is None else parse(reply)
+                for (cmd, parse), (ok, reply) in zip(cmds, replies)]
+
+    def status(self):
+        """Returns a Status of every axis, taken in one round trip."""
+        letters = [chr(65+i) for i in range(self.axes)]
+        cmds = ([("TP", parse_values)] +
+                [("MG _BG"+l, parse_flag) for l in letters] +
+                [("MG _MO"+l, parse_flag) for l in letters])
+        t = time.time()
+        replies = self.batch(*cmds)
+        position = replies[0] if self.axes > 1 else (replies[0],)
+        in_motion = tuple(replies[1:1+self.axes])
+        motor_on = tuple(not off for off in replies[1+self.axes:])
+        return Status(t, position, in_motion, motor_on)
+
+    def start_polling(self, rate):
+        """Starts the background thread updating self.snapshot rate times a
+        second."""
+        self.stop_polling()
+        self.polling = True
+        self.poller = threading.Thread(target=self.__poll, args=(1.0/rate,), name="galil poller")
+        self.poller.daemon = True
+        self.poller.start()
+
+    def stop_polling(self):
+        if getattr(self, "poller", None) is not None:
+            self.polling = False
+            self.poller.join()
+            self.poller = None
+
+    def __poll(self, period):
+        next_t = time.time()
+        while self.polling:
+            try:
+                snapshot = self.status()
+            except Exception as e: #keep polling, the error is kept for callers
+                self.poll_error = e
+            else:
+                previous, self.snapshot = self.snapshot, snapshot
+                self.poll_error = None
+                if self.queue is not None and (previous is None or previous[1:] != snapshot[1:]):
+                    self.queue.put(snapshot)
+            next_t = max(next_t+period, time.time()) #don't try to catch up
+            time.sleep(max(0, next_t-time.time()))
+
+    def error_message(self):
+        """Returns the code and description of the last error."""
+        try:
+            return self.send_read("TC1")
+        except GalilError:
+            return "unknown error"
 
     def __optional(self, x_i):
         """Logic for commands with optional arguments."""
@@ -58,13 +251,19 @@ class Galil(object):
         """Sets the jogspeed of axis x_i to v."""
         return self.__command("JG{}={}", x_i, v)
 
+    def stream_records(self, period=1, history=10000):
+        """Starts binary data record streaming on a second connection and
+        returns the DataRecordStream. period is in servo samples (ms by
+        default), so period=1 gives 1 kHz records of every axis."""
+        return DataRecordStream(self, self.ip, self.port, period, history)
+
     def get_position(self, x_i=None):
         """Returns the position of axis x_i.
         If x_i is None, returns a every position.
         The returned value is either an int or a tuple of ints."""
         x = self.__command("TP{}", x_i)
         #print x
-        return eval(x)
+        return parse_values(x)
     
     def begin_motion(self, x_i=None):
         """Begins motion on axis x_i.
@@ -73,7 +272,7 @@ class Galil(object):
 
     def in_motion(self, x_i):
         """Checks if axis x_i is in motion. returns a bool."""
-        return bool(eval(self.__command("MG _BG{}", x_i)))
+        return parse_flag(self.__command("MG _BG{}", x_i))
 
     def end_motion(self, x_i=None):
         """Stops motion on axis x_i.
@@ -95,35 +294,29 @@ class Galil(object):
         If x_i is None, then all axes are turned off."""
         return self.__command("MO{}", x_i)
 
-    def scan(self, x_i, degrees, period, cycles):
-        # max_accel = max_deccel = 1e6
-        #initial_angle = 0
-        self.motor_on(x_i) #make sure a motor is on
-        frequency = 1.0/period
-        #convert degrees to an amplitude in encoder counts
-        frequency = 1.0/period
-        radius = int(degrees/9.*12800)
-        axis_letter = chr(65+x_i)
-        code = "VM{0}N;VA {1};VD {1};VS {2};CR {3}, 0, {4};VE;BGS"
-        code = code.format(axis_letter,
-                           1e6, #max accel and deccel
-                           int(2*math.pi*radius*frequency),
-                           radius,
-                           360*cycles)
-        for line in code.split(';'):
-            print line
-            self.con.write(line+';')
-            time.sleep(0.03)
+    def scan(self, x_i, degrees, period, cycles, counts_per_degree=12800/9.):
+        """Swings axis x_i degrees either side of where it is now, period
+        seconds per swing, as a contour mode trajectory on axes A and B.
+        Returns the running ContourStreamer, stop() it to abort."""
+        self.motor_on() #make sure the motors are on
+        position = self.get_position()
+        center = [p/counts_per_degree for p in position[:2]]
+        path = oscillation(center[0], center[1], x_i, degrees, period, cycles)
+        counts = lambda az, el: (az*counts_per_degree, el*counts_per_degree)
+        return ContourStreamer(self, path, counts).start()
 
     def close(self, motors_off=True):                  #Optionally turn the motors off, and then try to close the socket
                                         # connection gracefully
+        self.stop_polling()
         if self.con:
             try:                            # Since this is called by both the GUI and the destructor, we have to simply catsh and ignore errors here.
                 print "Closing Connection"     # otherwise, there are errors arising from the fact that it winds up trying to close a closed connection.
                 if motors_off: self.motor_off()
                 self.con.close()
                 self.con = None
+                if self.tracer: self.tracer.close()
             except:
                 pass
     def __del__(self):
-        self.close()
+        if hasattr(self, "con"): #else the connection was never made
+            self.close()
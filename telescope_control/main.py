@@ -1,15 +1,21 @@
 from gui import MyFrame
-from galil import Galil
+from controllers import ControllerPool
 from config import Config
-from units import Units
-import time, wx
+from units import Units, format_degrees
+from ephemeris import Ephemeris, Tracker, MAX_RATE, MIN_EL
+from trajectory import ContourStreamer, oscillation
+import math, time, wx
 
 class MainWindow(MyFrame):
     def __init__(self, galil, converter, *args, **kwargs):
+        #with a pool, stop all halts every controller, not just this one
+        self.pool = kwargs.pop("pool", None)
         MyFrame.__init__(self, *args, **kwargs)
         self.poll_update = wx.Timer(self)
         self.galil = galil
         self.converter = converter
+        self.tracker = None
+        self.scanner = None
 
         #wx.EVT_TIMER(self, self.poll_update.GetId(), self.update_display)
         self.Bind(wx.EVT_TIMER, self.update_display, self.poll_update)
@@ -20,9 +26,19 @@ class MainWindow(MyFrame):
         stops = [(self.button_stop_all, None),
                  (self.button_stop_az, 0),
                  (self.button_stop_el, 1)]
+        if self.tracker is not None: #any stop ends tracking
+            self.tracker.stop()
+            self.tracker.ephemeris.stop()
+            self.tracker = None
+        if self.scanner is not None: #and scanning
+            self.scanner.stop()
+            self.scanner = None
         for stop, axis in stops:
             if event.GetId() == stop.GetId():
-                self.galil.end_motion(axis)
+                if axis is None and self.pool is not None:
+                    self.pool.stop_all()
+                else:
+                    self.galil.end_motion(axis)
                 break
         event.Skip()
 
@@ -38,8 +54,9 @@ class MainWindow(MyFrame):
 
     def set_step_size(self, event):
         degrees = int(self.step_size_input.GetValue())
-        self.step_size = [self.converter.az_to_encoder(degrees),
-                          self.converter.el_to_encoder(degrees)]
+        #a step is a difference, so without the offsets
+        self.step_size = [int(round(self.converter.az_to_encoder(degrees, False))),
+                          int(round(self.converter.el_to_encoder(degrees, False)))]
         event.Skip()
 
     def move_rel(self, event):
@@ -72,12 +89,37 @@ class MainWindow(MyFrame):
                     self.scan_max_az_input.GetValue()]
             vals = map(int, vals)
             period, cycles = vals[:2]
-            degrees = vals[3]-vals[2]
-            self.galil.scan(0, degrees, period, cycles)
+            center, amplitude = (vals[2]+vals[3])/2., (vals[3]-vals[2])/2.
+            if self.scanner is not None:
+                self.scanner.stop()
+            position = self.galil.get_position()
+            el = self.converter.encoder_to_sky(position[0], position[1])[1]
+            path = oscillation(center, el, 0, amplitude, period, cycles)
+            self.scanner = ContourStreamer(self.galil, path, self.converter.sky_to_encoder).start()
         else:
             print "{} scan not implemented!".format(scan_type)
         event.Skip()
 
+    def track_radec(self, event):
+        ra = self.ctrl_ra_tracking.GetValue()
+        dec = self.ctrl_dec_tracking.GetValue()
+        if self.tracker is not None:
+            self.tracker.stop()
+            self.tracker.ephemeris.stop()
+            self.tracker = None
+        config = self.converter.c
+        max_rate = config["TrackMaxRate"] if "TrackMaxRate" in config else MAX_RATE
+        min_el = config["TrackMinEl"] if "TrackMinEl" in config else MIN_EL
+        ephemeris = Ephemeris(self.converter.lat, self.converter.lon, ra, dec).start()
+        tracker = Tracker(self.galil, ephemeris, self.converter.sky_to_encoder,
+                          max_rate=max_rate, min_el=min_el)
+        try:
+            self.tracker = tracker.start()
+        except ValueError as e:
+            ephemeris.stop()
+            print "not tracking: {}".format(e)
+        event.Skip()
+
     def update_display(self, event):
         #print "updating"
         statuses = [(self.az_status, "Az: "),
@@ -87,21 +129,24 @@ class MainWindow(MyFrame):
                     (self.local_status, "Local: "),
                     (self.lst_status, "Lst: "),
                     (self.utc_status, "Utc: ")]
-        while True: #Sometimes the galil responds with 
-            try:    #an empty string. When it does
-                data = list(self.galil.get_position())
-            except: #try again.
-                continue
-            else: #Otherwise, break the loop.
-                break
-        data = [self.converter.encoder_to_az(data[0]),
-                self.converter.encoder_to_el(data[1])]
-        data += list(self.converter.azel_to_radec(*data))
-        data += [self.converter.lct(),
-                 self.converter.lst(), 
-                 self.converter.utc()]
+        #The galil's poller keeps the snapshot fresh, reading it never
+        #waits on the network.
+        snapshot = self.galil.snapshot
+        if snapshot is None: #keep the old values until the first poll
+            event.Skip()
+            return
+        #ra/dec at the time the position was read, the clocks keep running
+        #even when the poller stalls
+        with self.converter.tick(snapshot.t):
+            data = list(snapshot.position)
+            az, el = self.converter.encoder_to_sky(data[0], data[1])
+            data = [format_degrees(az), format_degrees(el)]
+            data += list(self.converter.azel_to_radec(math.radians(az), math.radians(el)))
+        with self.converter.tick():
+            data += [self.converter.lct(),
+                     self.converter.lst(), 
+                     self.converter.utc()]
         data = map(str, data)
-        map(lambda (widget, prefix))
         for (widget, prefix), datum in zip(statuses, data):
             widget.SetLabel(prefix + datum)
         event.Skip()
@@ -109,11 +154,22 @@ class MainWindow(MyFrame):
 
 if __name__ == "__main__":
     config = Config("config.txt")
-    galil = Galil(config["IP"], config["PORT"])
+    #an optional "TRACE galil.log" line logs every byte on the wire
+    trace = config["TRACE"] if "TRACE" in config else None
+    pool = ControllerPool.from_config(config, poll=20, trace=trace)
+    name = pool.names()[0] #the GUI drives the first controller
+    galil = pool[name]
+    if galil is None:
+        raise pool.errors[name]
     converter = Units(config)
     app = wx.PySimpleApp(0)
     wx.InitAllImageHandlers()
-    frame_1 = MainWindow(galil, converter, None, -1, "")
+    frame_1 = MainWindow(galil, converter, None, -1, "", pool=pool)
     app.SetTopWindow(frame_1)
     frame_1.Show()
     app.MainLoop()
+    for name in pool.names():
+        if pool[name] is not None:
+            print name
+            print pool[name].stats.report()
+    pool.close()
@@ -0,0 +1,181 @@
+import socket
+import threading
+import time
+from collections import deque
+from galil import Galil, GalilError, GalilTimeout, TERMINATOR
+
+class Pending(object):
+    """The eventual response to a command sent with PipelinedGalil.submit.
+    The client's reader thread fails it with GalilTimeout once timeout
+    seconds have passed without a response."""
+    def __init__(self, cmd, parse=None, timeout=None):
+        self.cmd = cmd
+        self.parse = parse
+        self.sent = time.time()
+        self.deadline = self.sent+timeout
+        self.event = threading.Event()
+        self.ok = None
+        self.reply = None
+        self.error = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def _set(self, ok, reply):
+        self.ok, self.reply = ok, reply
+        self.event.set()
+
+    def _fail(self, error):
+        self.error = error
+        self.event.set()
+
+    def result(self, timeout=None):
+        """Waits for the response and returns it, parsed if a parser was
+        given. An extra timeout can be given to give up waiting earlier, but
+        python 2 waits with a timeout by polling, so it adds latency."""
+        if timeout is None:
+            self.event.wait() #a plain blocking lock acquire, wakes up at once
+        elif not self.event.wait(timeout):
+            raise GalilTimeout(self.cmd, "no response after {} s".format(timeout))
+        if self.error is not None:
+            raise self.error
+        if not self.ok:
+            raise GalilError(self.cmd, "rejected by the controller")
+        return self.reply if self.parse is None else self.parse(self.reply)
+
+class PipelinedGalil(Galil):
+    """A Galil that keeps several commands in flight on one connection.
+
+    Commands are written as soon as they are submitted and a reader thread
+    hands the responses, which the galil sends back in order, to the
+    matching Pending. The usual methods (move_to, get_position, status,
+    scan, ...) block only the thread calling them, so polling, tracking and
+    operator commands from different threads overlap instead of queueing
+    behind each other. submit() gives non-blocking access.
+
+    This is what an asyncio client would provide, done with a thread since
+    this code runs on python 2."""
+
+    def connect(self, ip, port):
+        con = socket.create_connection((ip, port), self.timeout)
+        con.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        con.settimeout(0.05) #how often the reader checks for timeouts
+        if not hasattr(self, "pending"): #else a reconnect
+            self.pending = deque()
+            self.write_lock = threading.Lock()
+        self.reader = threading.Thread(target=self.__read, args=(con,), name="galil reader")
+        self.reader.daemon = True
+        self.reader.start()
+        return con
+
+    def __read(self, con):
+        buf = ""
+        error = GalilError("", "connection closed")
+        try:
+            while True:
+                try:
+                    data = con.recv(4096)
+                except socket.timeout:
+                    self.__expire()
+                    continue
+                if not data:
+                    break
+                if self.tracer:
+                    self.tracer("rx", data)
+                buf += data
+                match = TERMINATOR.search(buf)
+                while match:
+                    reply, buf = buf[:match.start()].strip(), buf[match.end():]
+                    if self.pending: #else a response nobody is waiting for
+                        pending = self.pending.popleft()
+                        if not pending.done(): #unless it already timed out
+                            ok = match.group() == ":"
+                            self.stats.record(pending.cmd, time.time()-pending.sent, ok, reply)
+                            pending._set(ok, reply)
+                    match = TERMINATOR.search(buf)
+                self.__expire()
+        except socket.error as e:
+            error = GalilError("", str(e))
+        with self.write_lock:
+            while self.pending:
+                self.pending.popleft()._fail(error)
+
+    def __expire(self):
+        """Fails the pending commands that are past their deadline. They
+        stay queued so a late response is still matched to them."""
+        now = time.time()
+        for pending in list(self.pending):
+            if now > pending.deadline and not pending.done():
+                self.stats.record_timeout(pending.cmd)
+                pending._fail(GalilTimeout(pending.cmd, "no response in time"))
+
+    def submit(self, cmd, parse=None, timeout=None):
+        """Sends cmd right away and returns its Pending response."""
+        pending = Pending(cmd, parse, self.timeout if timeout is None else timeout)
+        with self.write_lock:
+            #queue first so the reader can never see a response before it
+            self.pending.append(pending)
+            try:
+                self.__send(cmd+";")
+            except:
+                self.pending.pop() #never sent, don't wait for a response
+                raise
+        return pending
+
+    def submit_many(self, cmds, timeout=None):
+        """Sends commands, strings or (string, parse) pairs, in one write and
+        returns their Pendings."""
+        cmds = [(cmd, None) if isinstance(cmd, str) else cmd for cmd in cmds]
+        timeout = self.timeout if timeout is None else timeout
+        pendings = [Pending(cmd, parse, timeout) for cmd, parse in cmds]
+        with self.write_lock:
+            self.pending.extend(pendings)
+            try:
+                self.__send(''.join(cmd+";" for cmd, parse in cmds))
+            except:
+                for pending in pendings:
+                    self.pending.pop()
+                raise
+        return pendings
+
+    def __send(self, data):
+        if self.tracer:
+            self.tracer("tx", data)
+        self.con.sendall(data)
+
+    def exchange(self, cmd, timeout=None):
+        return self.submit(cmd, timeout=timeout).result()
+
+    def batch(self, *cmds, **kwargs):
+        pendings = self.submit_many(cmds, kwargs.get("timeout"))
+        results, failed = [], []
+        for pending in pendings:
+            try:
+                results.append(pending.result())
+            except GalilTimeout:
+                raise
+            except GalilError:
+                failed.append(pending.cmd)
+        if failed:
+            raise GalilError(';'.join(failed), "rejected by the controller")
+        return results
+
+    def disconnect(self):
+        if self.con:
+            try:
+                self.con.shutdown(socket.SHUT_RDWR) #wakes up the reader
+            except:
+                pass
+            #the reader fails whatever is still pending before it exits
+            self.reader.join()
+        Galil.disconnect(self)
+
+    def close(self, motors_off=True):
+        self.stop_polling()
+        if self.con:
+            try:
+                if motors_off: self.motor_off()
+                self.con.shutdown(socket.SHUT_RDWR) #wakes up the reader
+            except:
+                pass
+        Galil.close(self, False)
@@ -0,0 +1,143 @@
+import sys
+import numpy as np
+
+"""A mount pointing model fitted by least squares.
+
+The model gives the encoder reading minus the true position, in degrees,
+as a sum of terms (TPOINT names and signs):
+
+    IA    azimuth encoder offset       daz = -IA
+    IE    elevation encoder offset     del = IE
+    CA    collimation error            daz = -CA/cos(el)
+    NPAE  axis non-perpendicularity    daz = -NPAE*tan(el)
+    AN    az axis tilted north         daz = -AN*sin(az)*tan(el), del = -AN*cos(az)
+    AW    az axis tilted west          daz = -AW*cos(az)*tan(el), del = AW*sin(az)
+    TF    tube flexure                 del = -TF*cos(el)
+
+Fitting builds the normal equations one batch of samples at a time, so
+millions of samples never have to be in memory together. Azimuth
+residuals are weighted by cos(el) to make them distances on the sky.
+
+    python pointing.py config.txt samples.npy [samples.npy ...]
+
+fits every term to structured arrays with az, el, true_az and true_el
+fields and stores the model in the config.
+"""
+
+TERMS = ("IA", "IE", "CA", "NPAE", "AN", "AW", "TF")
+
+def design(az, el, terms=TERMS):
+    """The (daz, del) basis of terms at az and el in degrees, two arrays of
+    shape (len(az), len(terms))."""
+    a, e = np.radians(az), np.radians(el)
+    sin_a, cos_a = np.sin(a), np.cos(a)
+    cos_e, tan_e = np.cos(e), np.tan(e)
+    zero, one = np.zeros_like(a), np.ones_like(a)
+    basis = {"IA": (-one, zero),
+             "IE": (zero, one),
+             "CA": (-1/cos_e, zero),
+             "NPAE": (-tan_e, zero),
+             "AN": (-sin_a*tan_e, -cos_a),
+             "AW": (-cos_a*tan_e, sin_a),
+             "TF": (zero, -cos_e)}
+    return (np.column_stack([basis[t][0] for t in terms]),
+            np.column_stack([basis[t][1] for t in terms]))
+
+def wrap(degrees):
+    """Angles folded into -180..180."""
+    return (degrees+180.) % 360.-180.
+
+class PointingModel(object):
+    def __init__(self, **terms):
+        """Term values in degrees by name, missing terms are 0."""
+        unknown = set(terms)-set(TERMS)
+        if unknown:
+            raise ValueError("unknown pointing terms: {}".format(", ".join(sorted(unknown))))
+        self.terms = dict((t, float(terms.get(t, 0.))) for t in TERMS)
+        self.rms = None #sky rms residual of the fit in degrees
+        self.samples = 0
+
+    def __repr__(self):
+        return "PointingModel({})".format(", ".join(
+            "{}={!r}".format(t, self.terms[t]) for t in TERMS))
+
+    def offsets(self, az, el):
+        """(daz, del) arrays: encoder minus true position in degrees."""
+        A_az, A_el = design(np.atleast_1d(az), np.atleast_1d(el))
+        p = np.array([self.terms[t] for t in TERMS])
+        daz, d_el = A_az.dot(p), A_el.dot(p)
+        if np.ndim(az) == 0 and np.ndim(el) == 0:
+            return daz[0], d_el[0]
+        return daz, d_el
+
+    def apply(self, az, el):
+        """True az/el in degrees from encoder az/el. az is not wrapped, so
+        near 0 or 360 the correction can take it just outside 0-360."""
+        daz, d_el = self.offsets(az, el)
+        return az-daz, el-d_el
+
+    def invert(self, az, el, iterations=3):
+        """Encoder az/el that point at true az/el. The model is evaluated
+        at the encoder position, so this iterates, each round gaining a
+        factor of the (small) terms in accuracy."""
+        raw_az, raw_el = az, el
+        for i in range(iterations):
+            daz, d_el = self.offsets(raw_az, raw_el)
+            raw_az, raw_el = az+daz, el+d_el
+        return raw_az, raw_el
+
+    @classmethod
+    def fit(cls, az, el, true_az, true_el, terms=TERMS, chunk=2**20):
+        """Fits terms to encoder az/el against the true az/el of the same
+        samples, all arrays in degrees."""
+        n = len(az)
+        return cls.fit_batches(((az[i:i+chunk], el[i:i+chunk],
+                                 true_az[i:i+chunk], true_el[i:i+chunk])
+                                for i in range(0, n, chunk)), terms)
+
+    @classmethod
+    def fit_batches(cls, batches, terms=TERMS):
+        """Like fit, but takes an iterable of (az, el, true_az, true_el)
+        batches, e.g. read from files one at a time."""
+        k = len(terms)
+        normal, rhs = np.zeros((k, k)), np.zeros(k)
+        bb, samples = 0., 0
+        for az, el, true_az, true_el in batches:
+            az, el = np.asarray(az, dtype=np.float64), np.asarray(el, dtype=np.float64)
+            A_az, A_el = design(az, el, terms)
+            cos_e = np.cos(np.radians(el))
+            A = np.vstack([A_az*cos_e[:, None], A_el])
+            b = np.concatenate([wrap(az-true_az)*cos_e, el-true_el])
+            normal += A.T.dot(A)
+            rhs += A.T.dot(b)
+            bb += b.dot(b)
+            samples += len(az)
+        if not samples:
+            raise ValueError("no samples to fit")
+        p = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+        model = cls(**dict(zip(terms, p)))
+        #the residual sum of squares follows from the normal equations
+        residual = max(bb-2*p.dot(rhs)+p.dot(normal).dot(p), 0.)
+        model.rms = np.sqrt(residual/samples)
+        model.samples = samples
+        return model
+
+    @classmethod
+    def from_config(cls, config, prefix="Pointing"):
+        """The model stored by to_config, terms the config lacks are 0."""
+        return cls(**dict((t, config[prefix+t]) for t in TERMS if prefix+t in config))
+
+    def to_config(self, config, prefix="Pointing"):
+        """Stores every term as a "PointingIA 0.0123" style key."""
+        for t in TERMS:
+            config[prefix+t] = self.terms[t]
+
+if __name__ == "__main__":
+    from config import Config
+    config = Config(sys.argv[1])
+    batches = ((s["az"], s["el"], s["true_az"], s["true_el"])
+               for s in (np.load(path, mmap_mode="r") for path in sys.argv[2:]))
+    model = PointingModel.fit_batches(batches)
+    print model
+    print "{} samples, rms {:.2f} arcsec".format(model.samples, model.rms*3600)
+    model.to_config(config)
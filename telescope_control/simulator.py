@@ -0,0 +1,387 @@
+import SocketServer
+import socket
+import threading
+import random
+import math
+import time
+import re
+import sys
+from collections import deque
+
+"""A local stand in for the galil controller, for testing and benchmarks.
+
+Emulates the subset of DMC commands the Galil class uses: PA, PR, SP, JG,
+AC, DC, TP, BG, ST, SH, MO, MG _BG/_MO/_TP/_CM, TC1, WH, the VM/VA/VD/VS/CR/VE
+vector circle and the contour mode used by Galil.scan (CM, DT, CD). Axes follow
+trapezoidal velocity profiles. Every response is delivered latency plus up
+to jitter seconds after its command arrived, without holding up the
+commands behind it, like a delay on the network.
+
+    python simulator.py [port] [latency ms] [jitter ms]
+"""
+
+CONTOUR_BUFFER = 511 #segments
+
+class Profile(object):
+    """Motion starting at time t0 from position p0 and velocity v0, as a
+    list of (duration, acceleration) phases. The axis coasts at the final
+    velocity after the last phase, so a finished move ends with v=0."""
+    def __init__(self, t0, p0, v0, phases):
+        self.t0, self.p0, self.v0 = t0, p0, v0
+        self.phases = phases
+        self.end = t0+sum(d for d, a in phases)
+
+    def state(self, t):
+        """(position, velocity) at time t."""
+        p, v, left = self.p0, self.v0, t-self.t0
+        for d, a in self.phases:
+            dt = min(d, left)
+            p, v = p+v*dt+a*dt*dt/2., v+a*dt
+            left -= dt
+            if left <= 0:
+                return p, v
+        return p+v*left, v
+
+class CircleProfile(object):
+    """The projection onto one axis of a CR arc: radius r, starting angle
+    theta0 and sweep dtheta in degrees, at speed counts/s along the arc."""
+    def __init__(self, t0, p0, r, theta0, dtheta, speed):
+        self.t0, self.p0, self.r = t0, p0, r
+        self.theta0 = math.radians(theta0)
+        self.dtheta = math.radians(dtheta)
+        self.omega = math.copysign(float(speed)/r, dtheta) if r else 0
+        self.end = t0+(abs(self.dtheta)/abs(self.omega) if self.omega else 0)
+
+    def state(self, t):
+        theta = self.theta0+self.omega*(min(t, self.end)-self.t0)
+        v = -self.r*self.omega*math.sin(theta) if t < self.end else 0.
+        return self.p0+self.r*(math.cos(theta)-math.cos(self.theta0)), v
+
+def trapezoid(distance, speed, accel, decel):
+    """Phases of a move over distance that accelerates to at most speed."""
+    s = math.copysign(1, distance)
+    d = abs(distance)
+    #distance needed to reach full speed and to stop from it
+    if speed*speed/(2.*accel)+speed*speed/(2.*decel) > d: #triangular
+        speed = math.sqrt(2*d*accel*decel/(accel+decel))
+    t_acc, t_dec = speed/accel, speed/decel
+    coast = (d-speed*speed/(2.*accel)-speed*speed/(2.*decel))/speed if speed else 0
+    return [(t_acc, s*accel), (coast, 0), (t_dec, -s*decel)]
+
+class Axis(object):
+    def __init__(self):
+        self.motion = Profile(time.time(), 0, 0, [])
+        self.target = 0 #PA/PR target for the next BG
+        self.relative = False
+        self.jog = None #JG speed when jogging
+        self.jogging = False #begun in jog mode, even at speed 0
+        self.speed = 25000.
+        self.accel = 256000.
+        self.decel = 256000.
+        self.motor_on = True
+
+    def state(self, t):
+        return self.motion.state(t)
+
+    def moving(self, t):
+        p, v = self.state(t)
+        return self.jogging or t < self.motion.end or abs(v) > 1e-9
+
+    def begin(self, t):
+        p, v = self.state(t)
+        self.jogging = self.jog is not None
+        if self.jog is not None:
+            dv = self.jog-v
+            a = math.copysign(self.accel, dv)
+            self.motion = Profile(t, p, v, [(abs(dv)/self.accel, a)])
+        else:
+            distance = self.target if self.relative else self.target-p
+            self.motion = Profile(t, p, 0, trapezoid(distance, self.speed, self.accel, self.decel))
+
+    def stop(self, t, now=False):
+        p, v = self.state(t)
+        if now or v == 0:
+            self.motion = Profile(t, p, 0, [])
+        else:
+            self.motion = Profile(t, p, v, [(abs(v)/self.decel, -math.copysign(self.decel, v))])
+        self.jog = None
+        self.jogging = False
+
+class CommandError(Exception):
+    pass
+
+class Controller(object):
+    """The state of a simulated galil. execute(cmd) returns the response
+    text without the terminator or raises CommandError."""
+    def __init__(self, axes=2):
+        self.axes = [Axis() for i in range(axes)]
+        self.lock = threading.Lock()
+        self.last_error = "0"
+        self.vector = {"axis":None, "accel":256000., "decel":256000., "speed":25000., "segments":[]}
+        #contour mode: the axes in it, the segment time, queued CD
+        #increments and when the segment at the head of the queue started
+        self.contour = {"axes":[], "dt":0.016, "queue":deque(), "t":None, "ending":False}
+
+    def advance_contour(self, t):
+        """Applies the contour segments that have finished by time t."""
+        contour = self.contour
+        while contour["queue"] and t >= contour["t"]+contour["dt"]:
+            increments = contour["queue"].popleft()
+            contour["t"] += contour["dt"]
+            for i, inc in zip(contour["axes"], increments):
+                p = self.axes[i].state(contour["t"])[0]
+                self.axes[i].motion = Profile(contour["t"], p+inc, 0, [])
+        if not contour["queue"]:
+            contour["t"] = None #starved or done, restarts with the next CD
+            if contour["ending"]:
+                contour["axes"], contour["ending"] = [], False
+
+    def axis_index(self, letter):
+        i = ord(letter)-65
+        if not 0 <= i < len(self.axes):
+            raise CommandError("7 Command not valid in this context")
+        return i
+
+    def selected(self, arg):
+        """Axis indices an argument like '', 'A' or 'AB' refers to."""
+        if arg == "":
+            return range(len(self.axes))
+        return [self.axis_index(l) for l in arg]
+
+    def assign(self, arg, func):
+        """Handles 'A=100' and '100,200' style arguments."""
+        if "=" in arg:
+            letter, value = arg.split("=", 1)
+            func(self.axis_index(letter.strip()), float(value))
+        else:
+            for i, value in enumerate(arg.split(",")):
+                if value.strip():
+                    func(i, float(value))
+
+    def operand(self, name, t):
+        if name == "_CM": #free contour buffer space
+            return "{:.4f}".format(CONTOUR_BUFFER-len(self.contour["queue"]))
+        match = re.match(r"_(BG|MO|TP|TD)([A-Z])$", name)
+        if not match:
+            raise CommandError("1 Unrecognized command")
+        op, axis = match.group(1), self.axes[self.axis_index(match.group(2))]
+        if op == "BG":
+            value = 1 if axis.moving(t) else 0
+        elif op == "MO":
+            value = 0 if axis.motor_on else 1
+        else:
+            value = int(round(axis.state(t)[0]))
+        return "{:.4f}".format(value)
+
+    def execute(self, cmd):
+        t = time.time()
+        with self.lock:
+            try:
+                return self.__execute(cmd.strip(), t)
+            except (CommandError, ValueError) as e:
+                self.last_error = str(e) if isinstance(e, CommandError) else "1 Unrecognized command"
+                raise CommandError(self.last_error)
+
+    def __execute(self, cmd, t):
+        self.advance_contour(t)
+        if cmd == "":
+            return ""
+        op, arg = cmd[:2], cmd[2:].strip()
+        axes = self.axes
+        if op == "TP":
+            return ", ".join(str(int(round(axes[i].state(t)[0]))) for i in self.selected(arg))
+        if op == "MG":
+            return self.operand(arg, t)
+        if op in ("PA", "PR"):
+            def set_target(i, value):
+                axes[i].target, axes[i].relative, axes[i].jog = value, op == "PR", None
+            self.assign(arg, set_target)
+        elif op == "SP":
+            self.assign(arg, lambda i, v: setattr(axes[i], "speed", abs(v)))
+        elif op == "AC":
+            self.assign(arg, lambda i, v: setattr(axes[i], "accel", abs(v)))
+        elif op == "DC":
+            self.assign(arg, lambda i, v: setattr(axes[i], "decel", abs(v)))
+        elif op == "JG":
+            def set_jog(i, v):
+                axes[i].jog = v
+                if axes[i].jogging: #a new speed takes effect at once
+                    axes[i].begin(t)
+            self.assign(arg, set_jog)
+        elif op == "BG":
+            if arg == "S":
+                self.begin_vector(t)
+            else:
+                for i in self.selected(arg):
+                    if not axes[i].motor_on:
+                        raise CommandError("20 Begin not valid with motor off")
+                    if axes[i].moving(t) and axes[i].jog is None:
+                        raise CommandError("22 Begin not valid while running")
+                for i in self.selected(arg):
+                    axes[i].begin(t)
+        elif op == "ST":
+            for i in self.selected(arg.replace("S", "")):
+                axes[i].stop(t)
+        elif op == "SH":
+            for i in self.selected(arg):
+                axes[i].motor_on = True
+        elif op == "MO":
+            for i in self.selected(arg):
+                axes[i].stop(t, now=True)
+                axes[i].motor_on = False
+        elif op == "TC":
+            return self.last_error
+        elif op == "WH":
+            return "IHA"
+        elif op == "VM":
+            self.vector["axis"] = self.axis_index(arg.split(",")[0].strip()[0])
+            self.vector["segments"] = []
+        elif op == "VA":
+            self.vector["accel"] = float(arg)
+        elif op == "VD":
+            self.vector["decel"] = float(arg)
+        elif op == "VS":
+            self.vector["speed"] = float(arg)
+        elif op == "CR":
+            if self.vector["axis"] is None:
+                raise CommandError("7 Command not valid in this context")
+            self.vector["segments"].append([float(v) for v in arg.split(",")])
+        elif op == "VE":
+            pass
+        elif op == "CM":
+            self.contour["axes"] = self.selected(arg)
+            self.contour["queue"].clear()
+        elif op == "DT":
+            self.contour["dt"] = 2**int(arg)/1000.
+        elif op == "CD":
+            if not self.contour["axes"]:
+                raise CommandError("7 Command not valid in this context")
+            values, end = arg.split("=")[0], "=" in arg
+            increments = [int(v) for v in values.split(",")]
+            if end:
+                self.contour["ending"] = True
+            elif len(self.contour["queue"]) >= CONTOUR_BUFFER:
+                raise CommandError("29 Contour buffer full")
+            elif any(increments):
+                self.contour["queue"].append(increments)
+                if self.contour["t"] is None:
+                    self.contour["t"] = t
+        else:
+            raise CommandError("1 Unrecognized command")
+        return ""
+
+    def begin_vector(self, t):
+        if self.vector["axis"] is None or not self.vector["segments"]:
+            raise CommandError("7 Command not valid in this context")
+        axis = self.axes[self.vector["axis"]]
+        if not axis.motor_on:
+            raise CommandError("20 Begin not valid with motor off")
+        #only the first arc is simulated
+        r, theta0, dtheta = self.vector["segments"][0]
+        p = axis.state(t)[0]
+        axis.motion = CircleProfile(t, p, r, theta0, dtheta, self.vector["speed"])
+
+class Replies(object):
+    """Sends the replies of one connection in order, each when it is due,
+    from a thread of its own. The handler keeps executing the commands
+    behind it, so the delay acts like network latency: a batch costs one
+    latency, not one per command."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = deque() #(due time, data)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.last = 0. #replies never overtake each other
+        self.thread = threading.Thread(target=self.__send, name="simulator replies")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, due, data):
+        with self.cond:
+            self.last = max(self.last, due)
+            self.queue.append((self.last, data))
+            self.cond.notify()
+
+    def __send(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.queue and not self.closed:
+                        self.cond.wait()
+                    if not self.queue:
+                        return
+                    due, data = self.queue.popleft()
+                wait = due-time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self.sock.sendall(data)
+        except socket.error: #the client went away
+            pass
+
+    def close(self):
+        """Sends what is queued, then stops."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+class Handler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = self.server
+        replies = Replies(self.request)
+        buf = ""
+        try:
+            while True:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                received = time.time()
+                buf += data
+                parts = re.split(r"[;\r\n]", buf)
+                buf = parts.pop()
+                for cmd in parts:
+                    if not cmd.strip():
+                        continue
+                    due = received+server.latency+random.uniform(0, server.jitter)
+                    try:
+                        reply = server.controller.execute(cmd)
+                    except CommandError:
+                        replies.put(due, "?")
+                    else:
+                        replies.put(due, " {}\r\n:".format(reply) if reply else ":")
+        finally:
+            replies.close()
+
+class Simulator(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """A threaded TCP server around a Controller. Use port 0 to pick a free
+    port, it is available as sim.port."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0., jitter=0., axes=2):
+        SocketServer.TCPServer.__init__(self, (host, port), Handler)
+        self.controller = Controller(axes)
+        self.latency = latency
+        self.jitter = jitter
+        self.host, self.port = self.server_address
+        self.thread = None
+
+    def start(self):
+        """Serves from a background thread and returns self."""
+        self.thread = threading.Thread(target=self.serve_forever, name="galil simulator")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 23
+    latency = float(sys.argv[2])/1000. if len(sys.argv) > 2 else 0.001
+    jitter = float(sys.argv[3])/1000. if len(sys.argv) > 3 else 0.
+    sim = Simulator("", port, latency, jitter)
+    print "Simulating a galil on port {}".format(sim.port)
+    sim.serve_forever()
@@ -0,0 +1,158 @@
+import sys
+import os
+import time
+import datetime as dt
+import numpy as np
+import ephem
+
+"""Vectorized az/el to ra/dec for whole pointing datasets.
+
+Units.azel_to_radec converts one point per PyEphem call. The functions here
+take numpy arrays of azimuth and elevation in degrees (azimuth from north
+through east) and unix times. They return J2000 ra and dec in degrees.
+Sidereal time and the precession matrix are computed once per chunk of
+samples. Inside a chunk the sidereal time advances at the sidereal rate.
+
+Nutation, aberration and refraction are left out (Units sets pressure to 0,
+so there is no refraction there either). Compared to PyEphem the result is
+within TOLERANCE degrees on the sky for elevations below 89 degrees. Near
+the zenith ra is ill defined and only the separation is meaningful.
+
+    python sky.py config.txt file.h5 [file.h5 ...]
+
+converts the encoder archive files, writing file_radec.h5 next to each.
+"""
+
+#Largest separation from PyEphem's radec_of in degrees, 1 arcminute, most of
+#it from nutation and aberration.
+TOLERANCE = 1/60.
+
+J2000 = 2451545.0 #julian date of the J2000 epoch
+UNIX_EPOCH = 2440587.5 #julian date of 1970-01-01 00:00 UTC
+SIDEREAL_RATE = 360.98564736629 #degrees of sidereal time per solar day
+
+def julian_date(t):
+    return UNIX_EPOCH+np.asarray(t, dtype=np.float64)/86400.
+
+def gmst(t):
+    """Greenwich mean sidereal time in degrees (IAU 1982) at unix times t."""
+    d = julian_date(t)-J2000
+    T = d/36525.
+    return np.mod(280.46061837+SIDEREAL_RATE*d+0.000387933*T**2-T**3/38710000., 360.)
+
+def precession_matrix(t):
+    """Rotates unit vectors from the mean equator of unix time t to J2000
+    (IAU 1976 angles)."""
+    T = (julian_date(t)-J2000)/36525.
+    arcsec = np.pi/180/3600
+    zeta = (2306.2181*T+0.30188*T**2+0.017998*T**3)*arcsec
+    z = (2306.2181*T+1.09468*T**2+0.018203*T**3)*arcsec
+    theta = (2004.3109*T-0.42665*T**2-0.041833*T**3)*arcsec
+    cz, sz = np.cos(zeta), np.sin(zeta)
+    cZ, sZ = np.cos(z), np.sin(z)
+    ct, st = np.cos(theta), np.sin(theta)
+    #J2000 to date, the transpose goes back
+    to_date = np.array([[cz*ct*cZ-sz*sZ, -sz*ct*cZ-cz*sZ, -st*cZ],
+                        [cz*ct*sZ+sz*cZ, -sz*ct*sZ+cz*cZ, -st*sZ],
+                        [cz*st, -sz*st, ct]])
+    return to_date.T
+
+def _radec_chunk(az, el, t, lat, lon):
+    """One chunk, lat and lon in radians (east positive)."""
+    t0 = t[0]
+    lst = np.radians(gmst(t0)+SIDEREAL_RATE*(t-t0)/86400.)+lon
+    az, el = np.radians(az), np.radians(el)
+    sin_el, cos_el = np.sin(el), np.cos(el)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    #hour angle and declination of date
+    x = cos_lat*sin_el-sin_lat*cos_el*np.cos(az)
+    y = -cos_el*np.sin(az)
+    z = sin_lat*sin_el+cos_lat*cos_el*np.cos(az)
+    ra = lst-np.arctan2(y, x)
+    r = np.hypot(x, y)
+    v = np.array([r*np.cos(ra), r*np.sin(ra), z])
+    v = np.dot(precession_matrix(t0), v)
+    ra = np.mod(np.degrees(np.arctan2(v[1], v[0])), 360.)
+    dec = np.degrees(np.arctan2(v[2], np.hypot(v[0], v[1])))
+    return ra, dec
+
+def azel_to_radec(az, el, t, lat, lon, chunk=2**16):
+    """J2000 (ra, dec) arrays in degrees for az and el in degrees at unix
+    times t, seen from lat and lon (radians, or strings like 'd:m:s').
+    Scalars broadcast against the arrays."""
+    lat, lon = float(ephem.degrees(lat)), float(ephem.degrees(lon))
+    az, el, t = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (az, el, t)])
+    shape = az.shape
+    az, el, t = az.ravel(), el.ravel(), t.ravel()
+    ra, dec = np.empty_like(az), np.empty_like(az)
+    for i in range(0, len(az), chunk):
+        s = slice(i, i+chunk)
+        ra[s], dec[s] = _radec_chunk(az[s], el[s], t[s], lat, lon)
+    return ra.reshape(shape), dec.reshape(shape)
+
+RADEC = [("t", np.float64), ("ra", np.float64), ("dec", np.float64)]
+
+def minute_start(path):
+    """Unix time of the local minute a MM-DD-YYYY/HH-MM.h5 path is named
+    after, ValueError if it is not named that way."""
+    day = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    t = dt.datetime.strptime(day+" "+os.path.basename(path)[:-len(".h5")], "%m-%d-%Y %H-%M")
+    return time.mktime(t.timetuple())
+
+def file_times(h5file, path, anchor=None, start=None):
+    """A function of (rows, i) giving the unix times of the rows read from
+    row i of the file's "data" dataset.
+
+    Compacted files (attribute time "utc") already store unix time. Other
+    files turn monotonic t into unix time with anchor, a (utc, monotonic)
+    pair, or the file's utc_anchor and monotonic_anchor attributes. Files
+    with no t or no anchor have their rows spread evenly over the minute
+    from start, by default the minute the file is named after."""
+    data = h5file["data"]
+    has_t = "t" in (data.dtype.names or ())
+    if has_t and h5file.attrs.get("time") == "utc":
+        return lambda rows, i: rows["t"]
+    if has_t and anchor is None and "utc_anchor" in h5file.attrs:
+        anchor = h5file.attrs["utc_anchor"], h5file.attrs["monotonic_anchor"]
+    if has_t and anchor is not None:
+        utc, mono = anchor
+        return lambda rows, i: utc+(rows["t"]-mono)
+    if start is None:
+        try:
+            start = minute_start(path)
+        except ValueError:
+            raise ValueError("{} has no {} and is not named MM-DD-YYYY/HH-MM.h5, "
+                             "pass start".format(path, "time anchor" if has_t else "t field"))
+    n = float(max(len(data), 1))
+    return lambda rows, i: start+60.*(i+np.arange(len(rows)))/n
+
+def radec_file(path, lat, lon, out_path=None, chunk=2**18, anchor=None, start=None):
+    """Converts the "data" dataset of an encoder archive file (az, el in
+    degrees and t) into a "radec" dataset of unix time, ra and dec in
+    out_path, chunk rows at a time so memory use stays bounded.
+
+    Times come from file_times: anchor is a (utc, monotonic) pair for
+    files that lost their anchor attributes, start the unix time of the
+    minute for files without t. Returns out_path."""
+    import h5py
+    out_path = out_path or path[:-len(".h5")]+"_radec.h5"
+    with h5py.File(path, 'r') as h5in:
+        data = h5in["data"]
+        times = file_times(h5in, path, anchor, start)
+        with h5py.File(out_path, 'w') as h5out:
+            out = h5out.create_dataset("radec", shape=(len(data),), dtype=RADEC,
+                                       chunks=(min(chunk, max(len(data), 1)),))
+            h5out.attrs["source"] = path
+            for i in range(0, len(data), chunk):
+                rows = data[i:i+chunk]
+                block = np.empty(len(rows), dtype=RADEC)
+                block["t"] = times(rows, i)
+                block["ra"], block["dec"] = azel_to_radec(rows["az"], rows["el"], block["t"], lat, lon)
+                out[i:i+len(rows)] = block
+    return out_path
+
+if __name__ == "__main__":
+    from config import Config
+    config = Config(sys.argv[1])
+    for path in sys.argv[2:]:
+        print radec_file(path, str(config["LAT"]), str(config["LON"]))
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+import numpy as np
+from ephemeris import Ephemeris
+
+"""Precomputed scan paths, streamed to the galil's contour buffer.
+
+A Trajectory is a list of az/el positions in degrees, one every 2**n ms
+(the contour mode DT interval). Every path starts where the previous
+segment ended, so the controller only ever sees position increments and
+runs the whole scan on its own clock; Python only has to keep the buffer
+from running dry.
+"""
+
+class Trajectory(object):
+    def __init__(self, az, el, n=4):
+        """az and el are equally long lists of degrees, spaced 2**n ms."""
+        self.az = list(az)
+        self.el = list(el)
+        self.n = n
+        self.dt = 2**n/1000.
+
+    def __len__(self):
+        return len(self.az)
+
+    def duration(self):
+        return (len(self)-1)*self.dt
+
+    def __add__(self, other):
+        """Joins two trajectories with the same interval. The first point of
+        other is dropped if it repeats the last point of self."""
+        if other.n != self.n:
+            raise ValueError("trajectories have different intervals")
+        skip = 1 if len(self) and (other.az[:1], other.el[:1]) == (self.az[-1:], self.el[-1:]) else 0
+        return Trajectory(self.az+other.az[skip:], self.el+other.el[skip:], self.n)
+
+    def increments(self, counts):
+        """Contour segments in encoder counts. counts turns arrays of az and
+        el degrees into (az, el) count arrays (e.g. Units.sky_to_encoder,
+        which applies the pointing model). Positions are rounded before
+        differencing so rounding never accumulates."""
+        az, el = counts(np.array(self.az), np.array(self.el))
+        az = np.diff(np.rint(az).astype(np.int64)).tolist()
+        el = np.diff(np.rint(el).astype(np.int64)).tolist()
+        return zip(az, el)
+
+def ramp(distance, speed, accel, dt):
+    """Positions every dt seconds of a move over distance (>= 0) starting
+    and ending at rest: a trapezoidal velocity profile accelerating at
+    accel up to speed, or a triangle if the move is too short to reach it.
+    Time is stretched a little so the last position lands on a sample."""
+    if distance <= 0:
+        return [0., 0.]
+    speed = min(speed, math.sqrt(distance*accel))
+    t_ramp = speed/accel
+    t_total = distance/speed+t_ramp
+    steps = int(math.ceil(t_total/dt))
+    def position(t):
+        if t < t_ramp:
+            return accel*t*t/2.
+        if t < t_total-t_ramp:
+            return speed*(t-t_ramp/2.)
+        return distance-accel*(t_total-t)**2/2.
+    return [position(t_total*i/steps) for i in range(steps)]+[float(distance)]
+
+def line(az0, el0, az1, el1, speed, accel=1., n=4):
+    """A straight move from rest to rest, at up to speed degrees per second
+    and accelerating at accel degrees per second squared, both ends
+    included."""
+    length = math.hypot(az1-az0, el1-el0)
+    u = [p/length if length else 0. for p in ramp(length, speed, accel, 2**n/1000.)]
+    return Trajectory([az0+(az1-az0)*f for f in u], [el0+(el1-el0)*f for f in u], n)
+
+def raster(az_min, az_max, el_min, el_max, rows, speed, accel=1., n=4, serpentine=False):
+    """Scans rows rows of azimuth between el_min and el_max. A raster flies
+    back to az_min before each row, a serpentine reverses direction. Every
+    leg is a line, so the mount comes to rest at the end of each."""
+    path = None
+    for row in range(rows):
+        el = el_min+(el_max-el_min)*row/float(max(rows-1, 1))
+        start, end = az_min, az_max
+        if serpentine and row % 2:
+            start, end = end, start
+        if path is not None: #get from the end of the last row to this one
+            path = path+line(path.az[-1], path.el[-1], start, el, speed, accel, n)
+            path = path+line(start, el, end, el, speed, accel, n)
+        else:
+            path = line(start, el, end, el, speed, accel, n)
+    return path
+
+def serpentine(az_min, az_max, el_min, el_max, rows, speed, accel=1., n=4):
+    return raster(az_min, az_max, el_min, el_max, rows, speed, accel, n, serpentine=True)
+
+def spin(el, rpm, duration, az0=0., accel=1., n=4):
+    """Azimuth rotation at constant elevation for duration seconds, ramping
+    up to rpm and back down to rest at accel degrees per second squared.
+    Azimuth is not wrapped so the mount keeps turning the same way."""
+    rate = 360.*abs(rpm)/60.
+    sign = -1. if rpm < 0 else 1.
+    rate = min(rate, accel*duration/2.) #peak speed of a short spin
+    distance = rate*(duration-rate/accel) if rate else 0.
+    az = [az0+sign*p for p in ramp(distance, rate, accel, 2**n/1000.)]
+    return Trajectory(az, [el]*len(az), n)
+
+def oscillation(az0, el0, axis, amplitude, period, cycles, n=4):
+    """Swings one axis (0 az, 1 el) cycles times through amplitude degrees
+    either side of az0/el0, period seconds per swing. The path starts and
+    turns around at rest, amplitude below the center."""
+    dt = 2**n/1000.
+    steps = int(round(period*cycles/dt))
+    swing = [-amplitude*math.cos(2*math.pi*i*dt/period) for i in range(steps+1)]
+    if axis == 0:
+        return Trajectory([az0+s for s in swing], [el0]*(steps+1), n)
+    return Trajectory([az0]*(steps+1), [el0+s for s in swing], n)
+
+def unwrap(degrees):
+    """Removes the 360 degree jumps from a list of angles."""
+    out = degrees[:1]
+    for d in degrees[1:]:
+        out.append(d+360.*round((out[-1]-d)/360.))
+    return out
+
+def sidereal(lat, lon, ra, dec, duration, start=None, n=4):
+    """Tracks a fixed ra/dec (strings like 'h:m:s' and 'd:m:s') from start
+    (a unix time, default now) for duration seconds. PyEphem is evaluated
+    once a second and interpolated in between."""
+    dt = 2**n/1000.
+    start = time.time() if start is None else start
+    ephemeris = Ephemeris(lat, lon, ra, dec, span=duration+2.)
+    ephemeris.table = ephemeris.build(start)
+    points = [ephemeris.at(start+i*dt) for i in range(int(duration/dt)+1)]
+    return Trajectory(unwrap([p[0] for p in points]), [p[1] for p in points], n)
+
+class ContourStreamer(object):
+    """Runs a Trajectory in contour mode on axes A (az) and B (el).
+
+    A background thread first moves the galil to the start of the path,
+    then writes segments whenever the contour buffer (MG _CM) has room,
+    several per write. counts is as for Trajectory.increments, batch is
+    the most segments sent in one write."""
+    def __init__(self, galil, trajectory, counts, batch=64):
+        self.galil = galil
+        self.trajectory = trajectory
+        self.counts = counts
+        self.segments = trajectory.increments(counts)
+        self.batch = batch
+        self.sent = 0
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Starts the slew and the streaming in the background, returns
+        self at once."""
+        self.running = True
+        self.thread = threading.Thread(target=self.__stream, name="contour")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def free_space(self):
+        return int(float(self.galil.send_read("MG _CM")))
+
+    def __settle(self):
+        """Waits for both axes to stop, False if stopped meanwhile."""
+        while self.running and any(self.galil.in_motion(i) for i in (0, 1)):
+            time.sleep(0.05)
+        return self.running
+
+    def __slew(self):
+        """Moves to the start of the path, once the axes have come to rest
+        from whatever they were doing. False if stopped on the way."""
+        if not self.__settle():
+            return False
+        az, el = self.counts(self.trajectory.az[0], self.trajectory.el[0])
+        self.galil.move_to(0, int(round(az)))
+        self.galil.move_to(1, int(round(el)))
+        self.galil.begin_motion()
+        return self.__settle()
+
+    def __stream(self):
+        dt = self.trajectory.dt
+        try:
+            if not self.__slew():
+                return
+            self.galil.batch("CM AB", "DT {}".format(self.trajectory.n))
+            while self.running and self.sent < len(self.segments):
+                free = min(self.free_space(), len(self.segments)-self.sent)
+                while free > 0 and self.running:
+                    chunk = self.segments[self.sent:self.sent+min(free, self.batch)]
+                    self.galil.batch(*["CD {},{}".format(a, e) for a, e in chunk])
+                    self.sent += len(chunk)
+                    free -= len(chunk)
+                #the buffer drains one segment per dt, come back when a
+                #batch worth has room again
+                time.sleep(max(dt, self.batch*dt/2.))
+            if self.running:
+                self.galil.send_read("CD 0,0=0") #end of contour data
+        except Exception as e:
+            self.error = e
+        self.running = False
+
+    def wait(self):
+        """Blocks until every segment has been sent."""
+        self.thread.join()
+
+    def stop(self):
+        """Stops streaming and the axes."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.galil.end_motion()
@@ -1,58 +1,146 @@
+import threading
+import time
 import ephem
-from time import gmtime, strftime
+from contextlib import contextmanager
+from pointing import PointingModel
+from time import gmtime, localtime, strftime
+
+UNIX_EPOCH = ephem.Date("1970/1/1")
+
+class AxisCalibration(object):
+    """Encoder counts per degree and the offset in degrees of one axis, as
+    plain floats. Works on scalars and numpy arrays alike."""
+    def __init__(self, counts_per_rev, offset):
+        self.scale = float(counts_per_rev)/360.
+        self.offset = float(offset)
+
+    def to_encoder(self, degrees, ab=True):
+        return self.scale*(degrees + (self.offset if ab else 0.))
+
+    def from_encoder(self, counts, ab=True):
+        return counts/self.scale - (self.offset if ab else 0.)
+
+def format_degrees(val):
+    """Turns degrees into a 'd:m:s' string."""
+    sign = "-" if val < 0 else ""
+    s = round(abs(val)*3600., 2)
+    d, s = divmod(s, 3600.)
+    m, s = divmod(s, 60.)
+    return "{}{}:{:02d}:{:05.2f}".format(sign, int(d), int(m), s)
 
 class Units:
     def __init__(self, config):
-        """latitude and longitude need to be strings like 'd:m:s'"""
+        """LAT and LON in the config are degrees, like 'd:m:s' or -119.8"""
         self.c = config
-        self.lon = self.c["LON"]
-        self.lat = self.c["LAT"]
-        
-    def az_to_encoder(self, counts, ab=True):
-        return self.__to_encoder("AzEncPerRev", counts, ab)
-        
-    def el_to_encoder(self, counts, ab=True):
-        return self.__to_encoder("ElEncPerRev", counts, ab)
+        #the config turns "-119.8" into a float, which PyEphem would read
+        #as radians, as a string it is degrees
+        self.lon = str(self.c["LON"])
+        self.lat = str(self.c["LAT"])
+        #(config generation, az and el AxisCalibrations, PointingModel),
+        #replaced as a whole so other threads never see a mix
+        self.current = None
+        self.local = threading.local() #observer, tick time and memo per thread
+
+    def __current(self):
+        """self.current, rebuilt whenever the config has changed since it
+        was last built."""
+        current = self.current
+        generation = self.c.generation
+        if current is None or current[0] != generation:
+            current = (generation,
+                       AxisCalibration(self.c["AzEncPerRev"], self.c["AzOffset"]),
+                       AxisCalibration(self.c["ElEncPerRev"], self.c["ElOffset"]),
+                       PointingModel.from_config(self.c))
+            self.current = current
+        return current
+
+    def calibration(self):
+        """The (az, el) AxisCalibrations."""
+        return self.__current()[1:3]
 
-    def __to_encoder(self, flag, counts, ab):
-        offset = self.c["AzOffset"] if "Az" in flag else self.c["ElOffset"]
-        return self.c[flag]/360*(counts + (offset if ab else 0))
+    def pointing_model(self):
+        """The PointingModel stored in the config, all zero without one."""
+        return self.__current()[3]
+
+    def az_to_encoder(self, degrees, ab=True):
+        """Encoder counts (a float) of azimuth degrees, ab=False converts a
+        difference, leaving out the offset."""
+        return self.calibration()[0].to_encoder(degrees, ab)
+        
+    def el_to_encoder(self, degrees, ab=True):
+        return self.calibration()[1].to_encoder(degrees, ab)
     
     def encoder_to_az(self, counts, ab=True):
-        return self.__from_encoder("AzEncPerRev", counts, ab)
+        """Azimuth in degrees, format_degrees makes it readable."""
+        return self.calibration()[0].from_encoder(counts, ab)
+
+    def encoder_to_el(self, counts, ab=True):
+        return self.calibration()[1].from_encoder(counts, ab)
+
+    def encoder_to_sky(self, az_counts, el_counts):
+        """True az/el in degrees of encoder positions, corrected with the
+        pointing model."""
+        generation, az_cal, el_cal, model = self.__current()
+        return model.apply(az_cal.from_encoder(az_counts), el_cal.from_encoder(el_counts))
+
+    def sky_to_encoder(self, az, el):
+        """Encoder (az, el) counts that point at true az/el in degrees."""
+        generation, az_cal, el_cal, model = self.__current()
+        az, el = model.invert(az, el)
+        return az_cal.to_encoder(az), el_cal.to_encoder(el)
+
+    @contextmanager
+    def tick(self, t=None):
+        """A display or control tick in the calling thread:
+
+            with units.tick(t):
+                ...
+
+        Inside the block every time dependent method uses the one time t
+        (default now, a unix time), and the results that depend only on the
+        time are computed once. Afterwards they follow the clock again.
+        Yields t."""
+        saved = getattr(self.local, "t", None), getattr(self.local, "memo", None)
+        self.local.t = time.time() if t is None else t
+        self.local.memo = {}
+        try:
+            yield self.local.t
+        finally:
+            self.local.t, self.local.memo = saved
 
-    def encoder_to_el(self, counts,ab=True):
-        return self.__from_encoder("ElEncPerRev", counts, ab)
+    def now(self):
+        """The time of the current tick, or the actual time without one."""
+        t = getattr(self.local, "t", None)
+        return time.time() if t is None else t
 
-    def __from_encoder(self, flag, counts, ab):
-        offset = self.az_to_encoder(self.c["AzOffset"], False) if "Az" in flag else None
-        offset = self.el_to_encoder(self.c["ElOffset"], False) if offset is None else offset
-        return self.__str_degrees(360.0/self.c[flag]*(counts - (offset if ab else 0)))
+    def __memo(self, name, func):
+        memo = getattr(self.local, "memo", None)
+        if memo is None: #not ticking
+            return func()
+        if name not in memo:
+            memo[name] = func()
+        return memo[name]
 
-    def __str_degrees(self, val):
-        d = int(val)
-        m = int((val - d)/60.)
-        s = ((val - d)/60. - m)/60.
-        return "{}:{}:{:2.2f}".format(d, m, abs(s))
+    def observer(self):
+        """The calling thread's Observer, created once and dated now()."""
+        o = getattr(self.local, "observer", None)
+        if o is None:
+            o = self.local.observer = ephem.Observer()
+            o.lat = self.lat
+            o.lon = self.lon
+            o.pressure = 0
+            self.local.star = ephem.FixedBody()
+        o.date = ephem.Date(UNIX_EPOCH+self.now()/86400.)
+        return o
 
     def azel_to_radec(self, az, el):
         """az and el must be human readable string like 'h:m:s' or  floats
         in radians"""
-        o = ephem.Observer()
-        o.lat = self.lat
-        o.lon = self.lon
-        o.pressure = 0
-        return  o.radec_of(az, el)
+        return self.observer().radec_of(az, el)
 
     def radec_to_azel(self, ra, dec):
-        telescope = ephem.Observer()
-        telescope.lat = self.lat
-        telescope.lon = self.lon
-        d = "{t.tm_year}/{t.tm_mon}/{t.tm_mday} "
-        h = "{t.tm_hour}:{t.tm_min}:{t.tm_sec}"
-        telescope.date = (d+h).format(t=gmtime())
-
-        star = ephem.FixedBody()
+        telescope = self.observer()
+        star = self.local.star
         star._ra = ephem.hours(ra)
         star._dec = ephem.degrees(dec)
         star.compute(telescope)
@@ -63,16 +151,13 @@ class Units:
         self.c["ElOffset"] = current_El - wanted_El
 
     def lst(self):
-        o = ephem.Observer()
-        o.lat = self.lat
-        o.lon = self.lon
-        return o.sidereal_time()
+        return self.__memo("lst", lambda: self.observer().sidereal_time())
 
     def lct(self):
-        return strftime("%H:%M:%S")
+        return self.__memo("lct", lambda: strftime("%H:%M:%S", localtime(self.now())))
 
     def utc(self):
-        return "{t.tm_hour}:{t.tm_min}:{t.tm_sec}".format(t=gmtime())
+        return self.__memo("utc", lambda: "{t.tm_hour}:{t.tm_min}:{t.tm_sec}".format(t=gmtime(self.now())))
 
 if __name__=="__main__":
     from config import Config